@@ -0,0 +1,453 @@
+import numpy as np
+from models import Rank, CAMBIO_WEIGHT, DEFAULT_WEIGHTS, MAX_ROUNDS, NUM_CARDS, NUM_WEIGHTS, RANK_INDEX, SCORE_TABLE, WEIGHT_INDEX
+
+# advances N games at once, one round at a time, with all of the state in numpy arrays.
+# it follows the same rules as Game.start with WeightedPlayer policies (the default weights
+# play exactly like the random Player):
+#   hands[g, p, i]          card id at position i of player p's hand (-1 past the end)
+#   known[g, viewer, p, i]  whether viewer knows the card at position i of player p's hand
+# knowledge in Game is always either the real card or None, so a mask is all we need.
+#
+# every game reads its random numbers off its own stream of uniforms (one per random() call,
+# Fisher-Yates for shuffles), which is exactly what TapeRandom gives the object engine.
+# so Game(rng=TapeRandom(seed)).start() plays the same game as seed in a BatchGame.
+#
+# with split_streams, a game's shuffles, race dice and players' decisions each come off a
+# stream of their own instead, and every shuffle starts on a fresh block of NUM_CARDS
+# uniforms. two games on the same seed then get the same k-th shuffle and the same k-th dice
+# roll however differently their players play, which is what paired games need.
+# Game(**split_rngs(seed)) is the object engine's side of it
+
+TAPE_BLOCK = 128
+
+DECK_STREAM = 0
+DICE_STREAM = 1
+DECISION_STREAM = 2
+
+
+def uniforms(seeds, start, count, stream=0):
+    # uniforms start..start+count of each seed's stream. each one is splitmix64 of
+    # (seed, stream, position), so any block of any stream can be made without any generator
+    # state. stream 0 is the only one a game uses unless its streams are split
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    x = (seeds[:, None] << np.uint64(32)) + np.uint64(stream << 28) + np.uint64(start) + np.arange(count, dtype=np.uint64)
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)) * (1.0 / (1 << 53))
+
+
+SCORES = np.array(SCORE_TABLE, dtype=np.int64)
+WEIGHT_INDICES = np.array(WEIGHT_INDEX, dtype=np.int64)
+
+SEVEN = RANK_INDEX[Rank.SEVEN]
+EIGHT = RANK_INDEX[Rank.EIGHT]
+NINE = RANK_INDEX[Rank.NINE]
+TEN = RANK_INDEX[Rank.TEN]
+JACK = RANK_INDEX[Rank.JACK]
+QUEEN = RANK_INDEX[Rank.QUEEN]
+KING = RANK_INDEX[Rank.KING]
+
+# actions, as returned by Player.handle_card
+NONE = 0
+REPLACE = 1
+SHOW_OPP = 2
+SHOW_OWN = 3
+SWAP = 4
+SHOW_AND_SWAP = 5
+
+
+class TapeRandom:
+    # stand-in for random.Random that reads the same stream of uniforms a BatchGame does.
+    # with shuffle_block, every shuffle starts at the next multiple of shuffle_block
+    def __init__(self, seed, stream=0, shuffle_block=None):
+        self.stream = stream
+        self.shuffle_block = shuffle_block
+        self.seed(seed)
+
+    def seed(self, seed):
+        # back to the start of seed's stream, like random.Random.seed
+        self.seed_value = seed
+        self.seek(0)
+
+    def random(self):
+        if self.pos == len(self.tape):
+            self.seek(self.start + TAPE_BLOCK)
+        u = self.tape[self.pos]
+        self.pos += 1
+        return float(u)
+
+    def seek(self, position):
+        # the next random() is uniform number `position` of the stream
+        self.start = position - position % TAPE_BLOCK
+        self.tape = uniforms([self.seed_value], self.start, TAPE_BLOCK, self.stream)[0]
+        self.pos = position - self.start
+
+    def shuffle(self, x):
+        if self.shuffle_block is not None:
+            position = self.start + self.pos
+            if position % self.shuffle_block:
+                self.seek(position + self.shuffle_block - position % self.shuffle_block)
+        for i in reversed(range(1, len(x))):
+            j = int(self.random() * (i + 1))
+            x[i], x[j] = x[j], x[i]
+
+
+def split_rngs(seed):
+    # Game keyword arguments for the object engine's version of a BatchGame with split_streams
+    return {
+        'rng': TapeRandom(seed, DICE_STREAM),
+        'deck_rng': TapeRandom(seed, DECK_STREAM, shuffle_block=NUM_CARDS),
+        'player_rng': TapeRandom(seed, DECISION_STREAM),
+    }
+
+
+class BatchGame:
+    def __init__(self, seeds, width=8, weights=None, split_streams=False):
+        # weights are the WeightedPlayer weights of each game's two players, anything that
+        # broadcasts to (n, 2, NUM_WEIGHTS). split_streams is explained at the top
+        self.seeds = np.asarray(seeds, dtype=np.int64)
+        n = len(self.seeds)
+        self.n = n
+        self.width = width
+
+        weights = np.broadcast_to(np.asarray(DEFAULT_WEIGHTS if weights is None else weights, dtype=float), (n, 2, NUM_WEIGHTS))
+        # same thresholds as WeightedPlayer
+        self.keep_thresholds = 1 - weights[:, :, :CAMBIO_WEIGHT]
+        self.cambio_thresholds = 1 - weights[:, :, CAMBIO_WEIGHT]
+
+        self.split_streams = split_streams
+        if split_streams:
+            self.deck_stream, self.dice_stream, self.decision_stream = DECK_STREAM, DICE_STREAM, DECISION_STREAM
+        else:
+            self.deck_stream = self.dice_stream = self.decision_stream = 0
+        num_streams = 3 if split_streams else 1
+        self.tapes = [uniforms(self.seeds, 0, TAPE_BLOCK, stream) for stream in range(num_streams)]
+        self.tape_pos = np.zeros((num_streams, n), dtype=np.int64)
+
+        self.deck = np.zeros((n, NUM_CARDS), dtype=np.int8)
+        self.deck_pos = np.zeros(n, dtype=np.int64)
+        self.deck_len = np.full(n, NUM_CARDS, dtype=np.int64)
+        self.discard = np.full((n, NUM_CARDS), -1, dtype=np.int8)
+        self.discard_len = np.zeros(n, dtype=np.int64)
+
+        self.hands = np.full((n, 2, width), -1, dtype=np.int8)
+        self.hand_len = np.zeros((n, 2), dtype=np.int64)
+        self.known = np.zeros((n, 2, 2, width), dtype=bool)
+
+        self.has_called = np.zeros((n, 2), dtype=bool)
+        self.called = np.zeros(n, dtype=bool)
+        self.num_rounds = np.zeros(n, dtype=np.int64)
+        self.active = np.ones(n, dtype=bool)
+        # how many times each game's players took each action (NONE..SHOW_AND_SWAP)
+        self.action_counts = np.zeros((n, SHOW_AND_SWAP + 1), dtype=np.int64)
+
+    def start(self):
+        g = np.arange(self.n)
+        zeros = np.zeros(self.n, dtype=np.int64)
+        self._shuffle_decks()
+
+        # deal cards
+        cards = self._draw(g, 4)
+        for i in range(4):
+            self._add(g, zeros, cards[:, i], False)
+        cards = self._draw(g, 4)
+        for i in range(4):
+            self._add(g, zeros + 1, cards[:, i], False)
+        top_cards = self._draw(g, 1)[:, 0]
+        self._add_discard(g, top_cards)
+
+        # show first 2 cards to each player
+        self.known[:, 0, 0, 0:2] = True
+        self.known[:, 1, 1, 0:2] = True
+
+        # discard race at the beginning
+        self._discard_race(g, zeros, top_cards)
+
+        while self.active.any():
+            self._play_round()
+
+        return self.decide_winner()
+
+    def decide_winner(self):
+        cols = np.arange(self.width)
+        in_hand = cols < self.hand_len[:, :, None]
+        scores = np.where(in_hand, SCORES[self.hands.astype(np.int64)], 0).sum(axis=2)
+        player_one_scores = scores[:, 0]
+        player_two_scores = scores[:, 1]
+        # on a tie, player one only wins if player two called cambio
+        winners = np.where(player_one_scores < player_two_scores, 0,
+                           np.where(player_two_scores < player_one_scores, 1,
+                                    np.where(self.has_called[:, 1], 0, 1)))
+        return winners, player_one_scores, player_two_scores, self.num_rounds.copy()
+
+    def cambio_callers(self):
+        # the player who called cambio in each game, -1 if nobody did
+        return np.where(self.has_called.any(axis=1), self.has_called.argmax(axis=1), -1)
+
+    def _play_round(self):
+        g = np.flatnonzero(self.active)
+        self.num_rounds[g] += 1
+        # every active game is on the same round, so they all have the same current player
+        current = 0 if self.num_rounds[g[0]] % 2 == 1 else 1
+
+        called_before = self.called[g]
+
+        # player decides whether or not to call cambio
+        deciding = g[~called_before]
+        empty = self.hand_len[deciding, current] == 0
+        calls = empty.copy()
+        rolling = deciding[~empty]
+        calls[~empty] = self._uniform(rolling, self.decision_stream) > self.cambio_thresholds[rolling, current]
+        callers = deciding[calls]
+        self.has_called[callers, current] = True
+        self.called[callers] = True
+
+        # otherwise, draw a card and play it
+        turns = np.ones(len(g), dtype=bool)
+        turns[np.flatnonzero(~called_before)[calls]] = False
+        self._play_turn(g[turns], current, called_before[turns])
+
+        # the turn after cambio was called is the last one
+        self.active[g[turns & called_before]] = False
+        if self.num_rounds[g[0]] >= MAX_ROUNDS:
+            self.active[g] = False
+
+    def _play_turn(self, g, current, called):
+        if not len(g):
+            return
+        other = 1 - current
+        currents = np.full(len(g), current)
+        others = np.full(len(g), other)
+
+        drawn = self._draw(g, 1)[:, 0]
+        ranks = drawn >> 2
+        own_len = self.hand_len[g, current]
+        opp_len = self.hand_len[g, other]
+
+        # Player.handle_card: replace or play the card
+        replace = self._uniform(g, self.decision_stream) > self.keep_thresholds[g, current, WEIGHT_INDICES[drawn]]
+        played = np.select(
+            [((ranks == SEVEN) | (ranks == EIGHT)) & (opp_len > 0),
+             ((ranks == NINE) | (ranks == TEN)) & (own_len > 0),
+             ((ranks == JACK) | (ranks == QUEEN)) & (own_len > 0) & (opp_len > 0),
+             (ranks == KING) & (opp_len > 0)],
+            [SHOW_OPP, SHOW_OWN, SWAP, SHOW_AND_SWAP], NONE)
+        actions = np.where(replace, np.where(own_len > 0, REPLACE, NONE), played)
+        # nothing left to draw anywhere, the card can't be played
+        actions[drawn < 0] = NONE
+        self.action_counts[g, actions] += 1
+
+        race_games = []
+        race_cards = []
+
+        replacing = actions == REPLACE
+        r = g[replacing]
+        zeros = np.zeros(len(r), dtype=np.int64)
+        old_cards = self._delete(r, currents[replacing], zeros)
+        self._add(r, currents[replacing], drawn[replacing], True)
+        self._add_discard(r, old_cards)
+        race_games.append(r)
+        race_cards.append(old_cards)
+
+        self.known[g[actions == SHOW_OPP], current, other, 0] = True
+        self.known[g[actions == SHOW_OWN], current, current, 0] = True
+        self.known[g[actions == SHOW_AND_SWAP], current, other, 0] = True
+        # the king's swap is played as a jack, which needs both hands to have a card
+        swapping = ((actions == SWAP) | ((actions == SHOW_AND_SWAP) & (own_len > 0))) & ~called
+        s = g[swapping]
+        zeros = np.zeros(len(s), dtype=np.int64)
+        self._swap(s, currents[swapping], others[swapping], zeros, zeros)
+
+        powered = actions >= SHOW_OPP
+        self._add_discard(g[powered], drawn[powered])
+        race_games.append(g[powered])
+        race_cards.append(drawn[powered])
+
+        race_games = np.concatenate(race_games)
+        order = np.argsort(race_games)
+        self._discard_race(race_games[order], np.full(len(race_games), current), np.concatenate(race_cards)[order])
+
+    def _discard_race(self, g, currents, cards):
+        if not len(g):
+            return
+        others = 1 - currents
+        ranks = cards >> 2
+        own_one, opp_one = self._try_discard(g, currents, ranks)
+        own_two, opp_two = self._try_discard(g, others, ranks)
+        claim_one = (own_one >= 0) | (opp_one >= 0)
+        claim_two = (own_two >= 0) | (opp_two >= 0)
+        both = claim_one & claim_two
+
+        dice = np.zeros(len(g))
+        dice[both] = self._uniform(g[both], self.dice_stream)
+
+        # each game ends up with one card thrown away, from owner at position, and the owner
+        # gets two penalty cards if it was thrown away by the other player
+        owners = np.full(len(g), -1)
+        positions = np.full(len(g), -1)
+        penalised = np.zeros(len(g), dtype=bool)
+
+        def resolve(mask, owner, position, penalty):
+            owners[mask] = owner[mask]
+            positions[mask] = position[mask]
+            penalised[mask] = penalty
+
+        only_one = claim_one & ~claim_two
+        only_two = claim_two & ~claim_one
+        resolve(only_one & (opp_one >= 0), others, opp_one, True)
+        resolve(only_one & (own_one >= 0), currents, own_one, False)
+        resolve(only_two & (opp_two >= 0), currents, opp_two, True)
+        resolve(only_two & (own_two >= 0), others, own_two, False)
+
+        # one player is defending their own card, 0.8 chance to win
+        one_defends = both & (own_one >= 0) & (opp_two >= 0)
+        resolve(one_defends & (dice < 0.8), currents, own_one, False)
+        resolve(one_defends & (dice >= 0.8), currents, opp_two, True)
+        two_defends = both & (opp_one >= 0) & (own_two >= 0)
+        resolve(two_defends & (dice < 0.8), others, own_two, False)
+        resolve(two_defends & (dice >= 0.8), others, opp_one, True)
+        # it's a flip if both are going for their own cards or both for their opp's cards
+        both_own = both & (own_one >= 0) & (own_two >= 0)
+        resolve(both_own & (dice < 0.5), currents, own_one, False)
+        resolve(both_own & (dice >= 0.5), others, own_two, False)
+        both_opp = both & (opp_one >= 0) & (opp_two >= 0)
+        resolve(both_opp & (dice < 0.5), currents, opp_two, True)
+        resolve(both_opp & (dice >= 0.5), others, opp_one, True)
+
+        discarding = owners >= 0
+        self._delete(g[discarding], owners[discarding], positions[discarding])
+
+        p = g[penalised]
+        penalty_owners = owners[penalised]
+        penalties = self._draw(p, 2)
+        for i in range(2):
+            dealt = penalties[:, i] >= 0
+            self._add(p[dealt], penalty_owners[dealt], penalties[dealt, i], False)
+
+    def _try_discard(self, g, viewers, ranks):
+        # same as Player.try_discard: the first known own card of the rank, otherwise the
+        # first known card of the opp's. -1 where there isn't one
+        own = self._first_known(g, viewers, viewers, ranks)
+        opp = self._first_known(g, viewers, 1 - viewers, ranks)
+        return own, np.where(own >= 0, -1, opp)
+
+    def _first_known(self, g, viewers, owners, ranks):
+        hands = self.hands[g, owners]
+        matches = self.known[g, viewers, owners] & ((hands >> 2) == ranks[:, None]) & (hands >= 0)
+        return np.where(matches.any(axis=1), matches.argmax(axis=1), -1)
+
+    def _uniform(self, g, stream=0):
+        pos = self.tape_pos[stream, g]
+        while len(g) and pos.max() >= self.tapes[stream].shape[1]:
+            self._grow_tape(stream)
+        self.tape_pos[stream, g] = pos + 1
+        return self.tapes[stream][g, pos]
+
+    def _grow_tape(self, stream):
+        tape = self.tapes[stream]
+        more = uniforms(self.seeds, tape.shape[1], TAPE_BLOCK, stream)
+        self.tapes[stream] = np.concatenate([tape, more], axis=1)
+
+    def _shuffle_decks(self):
+        # Fisher-Yates over every deck at once, same as TapeRandom.shuffle
+        rows = np.arange(self.n)
+        decks = np.tile(np.arange(NUM_CARDS, dtype=np.int8), (self.n, 1))
+        for i in reversed(range(1, NUM_CARDS)):
+            j = (self._uniform(rows, self.deck_stream) * (i + 1)).astype(np.int64)
+            swapped = decks[rows, j]
+            decks[rows, j] = decks[:, i]
+            decks[:, i] = swapped
+        self.deck[:] = decks
+
+    def _draw(self, g, n):
+        # deals n cards off the top of each deck in g, -1 where there's nothing left to deal.
+        # same as Deck.deal with the discard pile
+        cards = np.full((len(g), n), -1, dtype=np.int8)
+        remaining = self.deck_len[g] - self.deck_pos[g]
+
+        enough = remaining >= n
+        e = g[enough]
+        pos = self.deck_pos[e]
+        cards[enough] = self.deck[e[:, None], pos[:, None] + np.arange(n)]
+        self.deck_pos[e] = pos + n
+
+        # running out is rare, so those games get dealt one at a time
+        for i in np.flatnonzero(~enough):
+            cards[i] = self._draw_reshuffling(g[i], n)
+        return cards
+
+    def _draw_reshuffling(self, game, n):
+        cards = list(self.deck[game, self.deck_pos[game]:self.deck_len[game]])
+        # everything but the top of the discard pile goes back into the deck, see Deck.reshuffle
+        num_discards = self.discard_len[game]
+        pile = list(self.discard[game, :max(num_discards - 1, 0)])
+        if num_discards > 0:
+            self.discard[game, 0] = self.discard[game, num_discards - 1]
+            self.discard_len[game] = 1
+        if self.split_streams:
+            # every shuffle starts on a block of its own, see TapeRandom.shuffle
+            pos = self.tape_pos[self.deck_stream, game]
+            self.tape_pos[self.deck_stream, game] = -(-pos // NUM_CARDS) * NUM_CARDS
+        for i in reversed(range(1, len(pile))):
+            j = int(self._uniform(np.array([game]), self.deck_stream)[0] * (i + 1))
+            pile[i], pile[j] = pile[j], pile[i]
+        self.deck[game, :len(pile)] = pile
+        self.deck_len[game] = len(pile)
+        self.deck_pos[game] = 0
+
+        dealt = min(n - len(cards), len(pile))
+        cards.extend(pile[:dealt])
+        self.deck_pos[game] = dealt
+        return cards + [-1] * (n - len(cards))
+
+    def _add_discard(self, g, cards):
+        self.discard[g, self.discard_len[g]] = cards
+        self.discard_len[g] += 1
+
+    def _add(self, g, owners, cards, known_card):
+        pos = self.hand_len[g, owners]
+        if len(g) and pos.max() >= self.width:
+            self._widen()
+        self.hands[g, owners, pos] = cards
+        self.known[g, owners, owners, pos] = known_card
+        self.known[g, 1 - owners, owners, pos] = False
+        self.hand_len[g, owners] += 1
+
+    def _delete(self, g, owners, positions):
+        # removes one card from each hand and shifts the rest down, like del on a list
+        rows = np.arange(len(g))
+        cols = np.arange(self.width)
+        src = np.minimum(cols + (cols >= positions[:, None]), self.width - 1)
+
+        hands = self.hands[g, owners]
+        cards = hands[rows, positions]
+        hands = np.take_along_axis(hands, src, axis=1)
+        hands[:, -1] = -1
+        self.hands[g, owners] = hands
+
+        for viewer in (0, 1):
+            known = np.take_along_axis(self.known[g, viewer, owners], src, axis=1)
+            known[:, -1] = False
+            self.known[g, viewer, owners] = known
+
+        self.hand_len[g, owners] -= 1
+        return cards
+
+    def _swap(self, g, players, opps, own_positions, opp_positions):
+        own_cards = self.hands[g, players, own_positions]
+        self.hands[g, players, own_positions] = self.hands[g, opps, opp_positions]
+        self.hands[g, opps, opp_positions] = own_cards
+        # both players see the swap, so whatever they knew moves along with the cards
+        for viewers in (players, opps):
+            own_known = self.known[g, viewers, players, own_positions]
+            self.known[g, viewers, players, own_positions] = self.known[g, viewers, opps, opp_positions]
+            self.known[g, viewers, opps, opp_positions] = own_known
+
+    def _widen(self):
+        extra = 8
+        n = self.n
+        self.hands = np.concatenate([self.hands, np.full((n, 2, extra), -1, dtype=np.int8)], axis=2)
+        self.known = np.concatenate([self.known, np.zeros((n, 2, 2, extra), dtype=bool)], axis=3)
+        self.width += extra
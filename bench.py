@@ -0,0 +1,234 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from functools import partial
+from models import CARDS, Deck, Game, Hand
+from simulation import run_simulation
+from utils import get_score
+
+# benchmarks for the hot paths of the engine. run it as
+#   python bench.py --output bench.json --baseline bench_baseline.json
+# every result is a rate (higher is better) or a peak memory in bytes (lower is better), and a
+# run that is worse than the baseline by more than the tolerance exits non-zero
+
+GAME_COUNTS = {
+    'object': (1000, 10000),
+    'batch': (1000, 10000, 100000),
+}
+QUICK_GAME_COUNTS = {
+    'object': (100,),
+    'batch': (1000,),
+}
+
+
+def time_per_draw(hand, draws):
+    # seconds per single-card deal, averaged over draws deals
+    start = time.perf_counter()
+    for _ in range(draws):
+        hand.deal(1)
+    return (time.perf_counter() - start) / draws
+
+
+def bench_draw(sizes=(52, 520, 5200, 52000), draws=50):
+    # per-draw cost of a Deck against dealing off the front of a plain Hand, for decks of
+    # different sizes. a Deck should cost the same at every size
+    results = []
+    for size in sizes:
+        cards = list(CARDS) * (size // len(CARDS))
+        deck = Deck()
+        deck.cards = list(cards)
+        hand = Hand()
+        hand.cards = list(cards)
+        results.append((size, time_per_draw(deck, draws), time_per_draw(hand, draws)))
+    return results
+
+
+DRAW_SIZES = (52, 520, 5200, 52000)
+QUICK_DRAW_SIZES = (52, 5200)
+
+
+def bench_deck_draw(size, number):
+    # number single-card deals off a Deck of size cards, put back on top whenever it runs out
+    deck = Deck()
+    deck.cards = list(CARDS) * (size // len(CARDS))
+    while number > 0:
+        deck.top = 0
+        for _ in range(min(number, size)):
+            deck.deal(1)
+        number -= size
+
+
+def draw_results(quick=False):
+    # the Deck's draw rate at every size, as run_benchmarks entries deck_draw_{size}. it should be
+    # the same at every size. bench_draw has the plain Hand to compare against, that's left
+    # out here since it isn't ours to guard
+    scale = 10 if quick else 1
+    return {f'deck_draw_{size}': {'draws_per_sec': rate(partial(bench_deck_draw, size), 100000 // scale)}
+            for size in (QUICK_DRAW_SIZES if quick else DRAW_SIZES)}
+
+
+def dealt_game(seed=0):
+    # a game right after the deal, before anyone has played
+    game = Game()
+    game.reset(seed)
+    game.deck.shuffle()
+    game.add_cards(game.player_one, game.player_two, game.deck.deal(4))
+    game.add_cards(game.player_two, game.player_one, game.deck.deal(4))
+    game.show_card(game.player_one, game.player_one, 0)
+    game.show_card(game.player_two, game.player_two, 0)
+    return game
+
+
+def rate(run, number):
+    # operations per second, best of 3
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        run(number)
+        best = min(best, time.perf_counter() - start)
+    return number / best
+
+
+def bench_hand_deal(number):
+    hand = Hand()
+    for _ in range(number // 52 + 1):
+        hand.cards = list(CARDS)
+        for _ in range(52):
+            hand.deal(1)
+
+
+def bench_deck_deal(number):
+    deck = Deck()
+    for _ in range(number // 52 + 1):
+        deck.reset()
+        for _ in range(52):
+            deck.deal(1)
+
+
+def bench_shuffle(number):
+    hand = Deck()
+    for _ in range(number):
+        hand.shuffle()
+
+
+def bench_swap_cards(number):
+    game = dealt_game()
+    for _ in range(number):
+        game.swap_cards(game.player_one, game.player_two, 0, 1)
+
+
+def bench_discard_race(number):
+    # the common case, where nobody knows a card of that rank
+    game = dealt_game()
+    known = {card.rank for card in game.player_one.hand.cards + game.player_two.hand.cards}
+    card = next(card for card in CARDS if card.rank not in known)
+    for _ in range(number):
+        game.discard_race(card)
+
+
+def bench_get_score(number):
+    game = dealt_game()
+    for _ in range(number):
+        get_score(game.player_one)
+
+
+MICRO_BENCHMARKS = {
+    'hand_deal': (bench_hand_deal, 20000),
+    'deck_deal': (bench_deck_deal, 20000),
+    'shuffle': (bench_shuffle, 5000),
+    'swap_cards': (bench_swap_cards, 50000),
+    'discard_race': (bench_discard_race, 50000),
+    'get_score': (bench_get_score, 50000),
+}
+
+
+def bench_turns(num_games):
+    # rounds per second of the Game.start loop, with the reset and scoring included
+    game = Game()
+    rounds = 0
+    start = time.perf_counter()
+    for seed in range(num_games):
+        game.reset(seed)
+        rounds += game.start(capture_hands=False).num_rounds
+    return rounds / (time.perf_counter() - start)
+
+
+def bench_games(engine, num_games):
+    start = time.perf_counter()
+    run_simulation(num_games, num_workers=1, engine=engine)
+    games_per_sec = num_games / (time.perf_counter() - start)
+
+    # separate run for memory, tracemalloc slows everything down
+    tracemalloc.start()
+    run_simulation(num_games, num_workers=1, engine=engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'games_per_sec': games_per_sec, 'peak_memory_bytes': peak}
+
+
+def run_benchmarks(quick=False):
+    scale = 10 if quick else 1
+    results = {}
+    for name, (bench, number) in MICRO_BENCHMARKS.items():
+        results[name] = {'ops_per_sec': rate(bench, number // scale)}
+    results.update(draw_results(quick))
+    results['turn_loop'] = {'rounds_per_sec': bench_turns(2000 // scale)}
+    for engine, counts in (QUICK_GAME_COUNTS if quick else GAME_COUNTS).items():
+        for num_games in counts:
+            results[f'games_{engine}_{num_games}'] = bench_games(engine, num_games)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    # returns (name, metric, baseline value, new value, regressed) for every metric both runs have
+    rows = []
+    for name, metrics in results['results'].items():
+        for metric, value in metrics.items():
+            old = baseline['results'].get(name, {}).get(metric)
+            if old is None:
+                continue
+            if metric.endswith('_per_sec'):
+                regressed = value < old * (1 - tolerance)
+            else:
+                regressed = value > old * (1 + tolerance)
+            rows.append((name, metric, old, value, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmarks for the cambio engine")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--baseline', help="json file from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="how much worse than the baseline is ok (default 0.1)")
+    parser.add_argument('--quick', action='store_true', help="smaller counts, for a quick check")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick)
+    for name, metrics in results['results'].items():
+        print(name, " ".join(f"{metric}={value:,.0f}" for metric, value in metrics.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print()
+        for name, metric, old, new, regressed in rows:
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {name} {metric}: {old:,.0f} -> {new:,.0f}")
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+import math
+import random
+import time
+from models import DEFAULT_WEIGHTS, MAX_ROUNDS, WEIGHT_INDEX, Action, Game, Player, Rank
+from rollout import determinize, draw_candidates
+from strategy import WeightedPlayer
+
+# a Player that searches for its decisions with information set monte carlo tree search
+# (single observer ISMCTS). every iteration deals out the cards it can't see at random
+# (rollout.determinize), walks the tree down its own decisions, picking between the ones that
+# are possible in that deal with UCB, and plays the rest of the game out with WeightedPlayers.
+# the tree only has the player's own decisions in it, the opp's rounds and the discard races
+# are played by the rollout policy in between, and the card drawn at the start of each turn is
+# a chance node keyed by its weight index (see models.WEIGHT_INDEX). the part of the tree below
+# what actually happened is kept from one decision to the next
+
+# the decisions in the tree. a node's children are keyed by what was decided, and the keys
+# are tagged with the kind of decision, since a node can have children of different kinds
+# (cambio or not depends on the deal) and False == 0 and True == 1 as dict keys
+CAMBIO = 'cambio' # start of the player's round, keyed (CAMBIO, whether cambio was called)
+CHANCE = 'chance' # the drawn card comes up, keyed (CHANCE, its weight index)
+DRAW = 'draw' # what to do with the drawn card, keyed (action, opp_index, own_index)
+
+CAMBIO_KEYS = ((CAMBIO, False), (CAMBIO, True))
+
+
+def chance_key(card):
+    return CHANCE, WEIGHT_INDEX[card.id]
+
+
+class Node:
+    __slots__ = ('children', 'visits', 'wins', 'available')
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.wins = 0
+        # how many times the node's decision was possible when its parent was visited
+        self.available = 0
+
+    def child(self, key):
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = Node()
+        return node
+
+
+class ISMCTSPlayer(Player):
+    # the game the player is in has to be given with join(game), the search needs to see the
+    # discard pile and the deck size as well as the player's own knowledge. every decision gets
+    # time_limit seconds of wall-clock time (and at most max_iterations iterations), checked
+    # between iterations, so one can go over by at most one playout. the rollouts are played
+    # with weights for this player and opp_weights for the opp
+    def __init__(self, time_limit=0.1, max_iterations=None, exploration=0.7, weights=DEFAULT_WEIGHTS,
+                 opp_weights=DEFAULT_WEIGHTS, seed=None, rng=None):
+        super().__init__(rng)
+        self.time_limit = time_limit
+        self.max_iterations = max_iterations
+        self.exploration = exploration
+        self.weights = weights
+        self.opp_weights = opp_weights
+        # the search has its own generator so it doesn't change the game's random numbers
+        self.search_rng = random.Random(seed)
+        self.game = None
+        self.root = None
+        self.last_round = -1
+        # totals over every search, see iterations_per_sec
+        self.iterations = 0
+        self.search_time = 0.0
+        self.last_search = None
+
+    def join(self, game):
+        self.game = game
+        return self
+
+    def reset(self):
+        super().reset()
+        self.root = None
+        self.last_round = -1
+
+    def decide_cambio(self, called_cambio, random_state=None):
+        if called_cambio:
+            return
+        _, call = self.search(CAMBIO, None, CAMBIO_KEYS)
+        if call:
+            self.call_cambio()
+
+    def handle_card(self, card, random_state=None):
+        # the drawn card is a chance node above the decision
+        self.root = self.current_root().child(chance_key(card))
+        knowledge = self.knowledge
+        candidates = draw_candidates(card, len(knowledge.own_hand), len(knowledge.opp_hand),
+                                     self.game.cambio_player is not None)
+        return self.search(DRAW, card, candidates)
+
+    def play_card(self, card, random_state=None):
+        # only asked directly for the swap half of a SHOW_AND_SWAP (as a Jack), everything else
+        # goes through handle_card. swaps our worst card for the opp's best, counting the cards
+        # we don't know as the expected score of an unseen card
+        if card.rank != Rank.JACK and card.rank != Rank.QUEEN:
+            return super().play_card(card, random_state)
+        knowledge = self.knowledge
+        if knowledge.own_hand.is_empty() or knowledge.opp_hand.is_empty():
+            return Action.NONE, None, None
+        unknown = knowledge.counter.expected_score()
+        own = [known.score if known is not None else unknown for known in knowledge.own_hand]
+        opp = [known.score if known is not None else unknown for known in knowledge.opp_hand]
+        own_index = max(range(len(own)), key=own.__getitem__)
+        opp_index = min(range(len(opp)), key=opp.__getitem__)
+        return Action.SWAP, opp_index, own_index
+
+    def try_discard(self, top_card):
+        # Player's, except a red king is worth keeping
+        action, opp_index, own_index = super().try_discard(top_card)
+        if own_index is not None and self.knowledge.own_hand[own_index].score < 0:
+            opp_index = self.knowledge.opp_hand.find_rank(top_card.id >> 2)
+            if opp_index is None:
+                return Action.NONE, None, None
+            return Action.DISCARD, opp_index, None
+        return action, opp_index, own_index
+
+    def current_root(self):
+        # the tree kept from the last decision, unless it's from another game
+        if self.root is None or self.game.num_rounds < self.last_round:
+            self.root = Node()
+        return self.root
+
+    def search(self, kind, drawn_card, candidates):
+        # runs the search from the current position and returns the candidate whose node got
+        # the most visits, then moves the root down to it
+        if self.game is None:
+            raise RuntimeError("ISMCTSPlayer needs join(game) before it can play")
+        game = self.game
+        root = self.current_root()
+        start = time.perf_counter()
+        deadline = start + self.time_limit
+        reused = root.visits
+        state = game.snapshot()
+        seat = game.seat(self)
+        players = [None, None]
+        players[seat] = WeightedPlayer(self.weights)
+        players[1 - seat] = WeightedPlayer(self.opp_weights)
+        spare = Game(rng=random.Random(self.search_rng.getrandbits(32)), player_one=players[0], player_two=players[1])
+
+        iterations = 0
+        while iterations == 0 or (time.perf_counter() < deadline
+                                  and (self.max_iterations is None or iterations < self.max_iterations)):
+            determinize(spare, state, seat, self.search_rng)
+            self.iterate(root, spare, seat, kind, drawn_card)
+            iterations += 1
+
+        elapsed = time.perf_counter() - start
+        self.iterations += iterations
+        self.search_time += elapsed
+        visits = [root.children[c].visits if c in root.children else 0 for c in candidates]
+        choice = candidates[max(range(len(candidates)), key=visits.__getitem__)]
+        self.last_search = {
+            'kind': kind,
+            'iterations': iterations,
+            'elapsed': elapsed,
+            'iterations_per_sec': iterations / elapsed,
+            'reused_visits': reused,
+            'choice': choice,
+            'visits': dict(zip(candidates, visits)),
+        }
+        self.root = root.child(choice)
+        self.last_round = game.num_rounds
+        return choice
+
+    def iterate(self, root, game, seat, kind, drawn_card):
+        # one iteration in a determinized game: down the tree until a new node gets added or
+        # the game ends, a rollout from there, and the result back up the path
+        node = root
+        path = [root]
+        over = False
+        while True:
+            if kind == CHANCE:
+                node = node.child(chance_key(drawn_card))
+                path.append(node)
+                kind = DRAW
+                continue
+            if kind == CAMBIO:
+                legal = CAMBIO_KEYS
+            else:
+                legal = draw_candidates(drawn_card, len(game.current_player.hand.cards),
+                                        len(game.other_player.hand.cards), game.cambio_player is not None)
+            untried = [key for key in legal if key not in node.children]
+            if untried:
+                key = untried[int(self.search_rng.random() * len(untried))]
+                for other in legal:
+                    if other in node.children:
+                        node.children[other].available += 1
+                child = node.child(key)
+                child.available += 1
+            else:
+                key = self.select(node, legal)
+                child = node.children[key]
+            path.append(child)
+            over, kind, drawn_card = self.apply(game, kind, key, drawn_card)
+            node = child
+            if over or untried:
+                break
+
+        if over:
+            winner = game.finish(capture_hands=False).winner
+        else:
+            winner = self.rollout(game, kind, drawn_card)
+        won = winner == seat
+        for node in path:
+            node.visits += 1
+            node.wins += won
+
+    def select(self, node, legal):
+        # UCB over the decisions that are possible in this deal, with how often each one was
+        # possible in place of the parent's visits
+        best_key, best = None, -math.inf
+        log = math.log
+        for key in legal:
+            child = node.children[key]
+            child.available += 1
+            score = child.wins / child.visits + self.exploration * math.sqrt(log(child.available) / child.visits)
+            if score > best:
+                best_key, best = key, score
+        return best_key
+
+    @staticmethod
+    def apply(game, kind, key, drawn_card):
+        # takes decision key for current_player and plays on to their next decision. returns
+        # (over, the next decision's kind, the drawn card it's about)
+        if kind == CAMBIO:
+            if key[1]:
+                game.current_player.call_cambio()
+                game.cambio_turn()
+                # the opp's last round
+                return game.play_round(), None, None
+            return False, CHANCE, game.draw()
+        if game.finish_turn(drawn_card, *key):
+            return True, None, None
+        # the opp's round, then the start of ours
+        if game.num_rounds >= MAX_ROUNDS or game.play_round() or game.num_rounds >= MAX_ROUNDS:
+            return True, None, None
+        game.num_rounds += 1
+        if game.cambio_player is None:
+            return False, CAMBIO, None
+        return False, CHANCE, game.draw()
+
+    @staticmethod
+    def rollout(game, kind, drawn_card):
+        # the rest of the game with the rollout policy, from the decision apply stopped at
+        player = game.current_player
+        if kind == CAMBIO:
+            player.decide_cambio(False)
+            if player.has_called_cambio:
+                over = game.cambio_turn()
+            else:
+                drawn = game.draw()
+                over = game.finish_turn(drawn, *player.handle_card(drawn))
+        else:
+            over = game.finish_turn(drawn_card, *player.handle_card(drawn_card))
+        if over:
+            return game.finish(capture_hands=False).winner
+        return game.play(capture_hands=False).winner
+
+    def iterations_per_sec(self):
+        return self.iterations / self.search_time if self.search_time else 0.0
+
+
+if __name__ == '__main__':
+    wins = 0
+    num_games = 20
+    bot = ISMCTSPlayer(time_limit=0.05, seed=0)
+    game = Game(player_one=bot)
+    bot.join(game)
+    for seed in range(num_games):
+        game.reset(seed)
+        wins += game.start(capture_hands=False).winner == 0
+    print(f"won {wins}/{num_games} against the random player, {bot.iterations_per_sec():,.0f} iterations/s")
@@ -1,8 +1,11 @@
 from enum import Enum
 import random
-from uuid import uuid4
+from collections import Counter
+from time import perf_counter
+from itertools import count
 from utils import get_score
-from typing import List
+from typing import List, NamedTuple, Optional
+from collections.abc import Sequence
 
 class Action(Enum):
     NONE = 'none'
@@ -13,6 +16,18 @@ class Action(Enum):
     DISCARD = 'discard'
 
 
+class RaceOutcome(Enum):
+    NONE = 'none' # nobody claimed the card
+    OWN = 'own' # one player threw away their own card
+    OPP = 'opp' # one player threw away their opp's card, opp gets penalties
+    DEFENDED = 'defended' # both claimed, the owner of the card won
+    DEFENSE_BROKEN = 'defense broken' # both claimed, the owner lost and gets penalties
+    OWN_FLIP = 'own flip' # both went for their own cards
+    OPP_FLIP = 'opp flip' # both went for each other's cards, the loser gets penalties
+
+PENALTY_OUTCOMES = (RaceOutcome.OPP, RaceOutcome.DEFENSE_BROKEN, RaceOutcome.OPP_FLIP)
+
+
 class Rank(Enum):
     ACE = 'Ace'
     TWO = 'Two'
@@ -34,6 +49,8 @@ class Suit(Enum):
     CLUBS = 'Clubs'
     SPADES = 'Spades'
 
+MAX_ROUNDS = 50
+
 RANK_TO_STRING = {
     Rank.ACE: 'A',
     Rank.TWO: '2',
@@ -57,11 +74,56 @@ SUIT_TO_STRING = {
     Suit.SPADES: 'S',
 }
 
+def resolve_rng(rng, random_state=None):
+    # a random_state gives a one-off generator seeded with it (what random.seed used to do)
+    # without touching the generator shared by the rest of the game
+    if random_state is not None:
+        return random.Random(random_state)
+    return rng
+
+
+# cards are encoded as a small int: rank index * 4 + suit index, so 0-51 in the same order
+# as a fresh Deck. Card/Rank/Suit are just a view on top of that for display and tests
+RANKS = list(Rank)
+SUITS = list(Suit)
+RANK_INDEX = {rank: i for i, rank in enumerate(RANKS)}
+SUIT_INDEX = {suit: i for i, suit in enumerate(SUITS)}
+NUM_CARDS = len(RANKS) * len(SUITS)
+
+def card_id(rank, suit):
+    return RANK_INDEX[rank] * 4 + SUIT_INDEX[suit]
+
+def rank_of_id(card_id):
+    return card_id >> 2
+
+def suit_of_id(card_id):
+    return card_id & 3
+
+def score_of_id(card_id):
+    rank = RANKS[rank_of_id(card_id)]
+    if rank == Rank.KING:
+        # red kings are -1, black kings are 30
+        return 30 if SUITS[suit_of_id(card_id)] in (Suit.CLUBS, Suit.SPADES) else -1
+    if rank == Rank.JACK or rank == Rank.QUEEN:
+        return 11
+    return rank_of_id(card_id) + 1
+
+# score of every card id, so scoring a card is a single index instead of an if-chain
+SCORE_TABLE = tuple(score_of_id(i) for i in range(NUM_CARDS))
+
+
 class Card:
-    def __init__(self, rank, suit):
-        self.rank = rank
-        self.suit = suit
-    
+    # there is exactly one Card object per card id (see CARDS), so building a deck or
+    # passing cards around never allocates. Card(rank, suit) hands back the shared one
+    __slots__ = ('id', 'rank', 'suit', 'score')
+
+    def __new__(cls, rank, suit):
+        return CARDS[card_id(rank, suit)]
+
+    @staticmethod
+    def from_id(card_id):
+        return CARDS[card_id]
+
     def __str__(self):
         return f"{RANK_TO_STRING[self.rank]}{SUIT_TO_STRING[self.suit]}"
     
@@ -69,12 +131,38 @@ class Card:
         return f"Card(rank={self.rank}, suit={self.suit})"
     
     def __eq__(self, other):
-        return self.rank == other.rank and self.suit == other.suit
+        return self.id == other.id
+
+    def __hash__(self):
+        return self.id
+
+    def __reduce__(self):
+        return Card.from_id, (self.id,)
+
+
+def _make_card(card_id):
+    card = object.__new__(Card)
+    card.id = card_id
+    card.rank = RANKS[rank_of_id(card_id)]
+    card.suit = SUITS[suit_of_id(card_id)]
+    card.score = SCORE_TABLE[card_id]
+    return card
+
+CARDS = tuple(_make_card(i) for i in range(NUM_CARDS))
+
+
+def encode_cards(cards):
+    # compact encoding of a list of cards, one byte per card
+    return bytes(card.id for card in cards)
+
+def decode_cards(data):
+    return [CARDS[i] for i in data]
 
 
 class Hand:
-    def __init__(self):
+    def __init__(self, rng=None):
         self.cards = []
+        self.rng = rng if rng is not None else random
     
     def peek(self):
         return self.cards[0]
@@ -85,7 +173,9 @@ class Hand:
     def is_empty(self):
         return len(self.cards) == 0
 
-    def deal(self, n, replacement_cards=[], random_state=None):
+    def deal(self, n, replacement_cards=None, random_state=None):
+        if replacement_cards is None:
+            replacement_cards = []
         curr_num_cards = len(self.cards)
         if n < curr_num_cards:
             # if n is less than the number of cards, it's easy
@@ -111,9 +201,7 @@ class Hand:
         return cards
 
     def shuffle(self, random_state=None):
-        if random_state is not None:
-            random.seed(random_state)
-        random.shuffle(self.cards)
+        resolve_rng(self.rng, random_state).shuffle(self.cards)
 
     def __str__(self):
         hand = ""
@@ -132,31 +220,379 @@ class Hand:
 
 
 class Deck(Hand):
-    def __init__(self, include_jokers=False):
-        self.cards = [Card(rank, suit) for rank in Rank for suit in Suit]
+    # cards are dealt from the front like a Hand, but by moving a cursor (self.top) along
+    # self.cards instead of deleting from the front of the list, so a draw costs the same
+    # however big the deck is. everything before self.top has already been dealt
+    def __init__(self, include_jokers=False, rng=None):
+        super().__init__(rng)
+        self.cards = list(CARDS)
+        self.top = 0
+        self.reshuffles = 0
+
+    def reset(self):
+        # back to a fresh deck, in the same list
+        self.cards[:] = CARDS
+        self.top = 0
+        self.reshuffles = 0
+
+    def remaining(self):
+        return len(self.cards) - self.top
+
+    def is_empty(self):
+        return self.top >= len(self.cards)
+
+    def peek(self):
+        return self.cards[self.top]
+
+    def deal(self, n, discard=None, random_state=None):
+        # deals n cards. if the deck runs out, whatever it has left comes first and then the
+        # discard pile (a Hand) is shuffled back in, see reshuffle. fewer than n cards come
+        # back if there aren't enough in the deck and discard pile together
+        cards = self.cards[self.top: self.top + n]
+        self.top += len(cards)
+        if len(cards) < n and discard is not None:
+            self.reshuffle(discard, random_state)
+            missing = n - len(cards)
+            cards.extend(self.cards[0: missing])
+            self.top = min(missing, len(self.cards))
+        return cards
+
+    def reshuffle(self, discard, random_state=None):
+        # everything in the discard pile except the top card becomes the new deck. the deck and
+        # the discard pile just trade lists, so nothing gets copied and they never share one
+        pile = discard.cards
+        top_card = pile.pop() if pile else None
+        dealt = self.cards
+        dealt.clear()
+        if top_card is not None:
+            dealt.append(top_card)
+        discard.cards = dealt
+        self.cards = pile
+        self.top = 0
+        self.reshuffles += 1
+        self.shuffle(random_state)
+
+    def shuffle(self, random_state=None):
+        # only the cards that haven't been dealt yet
+        if self.top:
+            del self.cards[0: self.top]
+            self.top = 0
+        super().shuffle(random_state)
+
+    def __str__(self):
+        return "".join(str(card) + " " for card in self.cards[self.top:])
     
 
+class CardCounter:
+    # one player's count of the cards they haven't seen yet, i.e. the ones that could be behind
+    # any card they don't know (in the deck or face down in a hand). cards are seen when they're
+    # shown, drawn or thrown away, and go back to unseen when the discard pile is shuffled back
+    # into the deck. everything is updated one card at a time, so asking is O(1)
+    def __init__(self):
+        self.seen = bytearray(NUM_CARDS)
+        self.rank_counts = [len(SUITS)] * len(RANKS)
+        self.unseen = NUM_CARDS
+        self.unseen_score = sum(SCORE_TABLE)
+
+    def reset(self):
+        self.seen[:] = bytes(NUM_CARDS)
+        self.rank_counts[:] = [len(SUITS)] * len(RANKS)
+        self.unseen = NUM_CARDS
+        self.unseen_score = sum(SCORE_TABLE)
+
+    def see(self, card):
+        if not self.seen[card.id]:
+            self.seen[card.id] = 1
+            self.rank_counts[card.id >> 2] -= 1
+            self.unseen -= 1
+            self.unseen_score -= card.score
+
+    def forget(self, card):
+        if self.seen[card.id]:
+            self.seen[card.id] = 0
+            self.rank_counts[card.id >> 2] += 1
+            self.unseen += 1
+            self.unseen_score += card.score
+
+    def snapshot(self):
+        # see Game.snapshot
+        return bytes(self.seen), tuple(self.rank_counts), self.unseen, self.unseen_score
+
+    def restore(self, state):
+        seen, rank_counts, self.unseen, self.unseen_score = state
+        self.seen[:] = seen
+        self.rank_counts[:] = rank_counts
+
+    def remaining(self, rank):
+        # how many cards of the rank haven't been seen
+        return self.rank_counts[RANK_INDEX[rank]]
+
+    def expected_score(self):
+        # EV of a card we don't know
+        return self.unseen_score / self.unseen if self.unseen else 0.0
+
+
+def known_score(card):
+    # score of a knowledge entry, unknown cards (None) count as 0
+    return card.score if card is not None else 0
+
+
+class KnownHand:
+    # what one player knows about one hand. every card gets a slot when it's added, always the
+    # one after the last slot used, and keeps it until it leaves the hand, so taking a card out
+    # is clearing a couple of bits instead of shifting lists around. the hand's order is the
+    # order of its occupied slots, lowest first, i.e. index i of the hand is the i-th one
+    #   slots     the card known to be in each slot, or None
+    #   occupied  bitmask of the slots with a card in them
+    #   known     bitmask of the occupied slots whose card is known
+    #   ranks     bitmask of the known slots of each rank, by rank index
+    __slots__ = ('slots', 'occupied', 'known', 'ranks')
+
+    def __init__(self):
+        self.slots = []
+        self.occupied = 0
+        self.known = 0
+        self.ranks = [0] * len(RANKS)
+
+    def clear(self):
+        self.slots.clear()
+        self.occupied = 0
+        self.known = 0
+        self.ranks[:] = [0] * len(RANKS)
+
+    def snapshot(self):
+        # see Game.snapshot
+        return tuple(self.slots), self.occupied, self.known, tuple(self.ranks)
+
+    def restore(self, state):
+        slots, self.occupied, self.known, ranks = state
+        self.slots[:] = slots
+        self.ranks[:] = ranks
+
+    def __len__(self):
+        return self.occupied.bit_count()
+
+    def is_empty(self):
+        return not self.occupied
+
+    def slot(self, index):
+        # slot of the card at index
+        occupied = self.occupied
+        if index < 0:
+            index += occupied.bit_count()
+            if index < 0:
+                raise IndexError("hand index out of range")
+        for _ in range(index):
+            # drop the lowest slot
+            occupied &= occupied - 1
+        if not occupied:
+            raise IndexError("hand index out of range")
+        return (occupied & -occupied).bit_length() - 1
+
+    def index(self, slot):
+        # index of the card in slot
+        return (self.occupied & ((1 << slot) - 1)).bit_count()
+
+    def __getitem__(self, index):
+        return self.slots[self.slot(index)]
+
+    def put(self, slot, card):
+        # sets what's known about the card in slot, returns what was known before
+        old = self.slots[slot]
+        self.slots[slot] = card
+        bit = 1 << slot
+        if old is not None:
+            # card id >> 2 is the rank index, see rank_of_id
+            self.ranks[old.id >> 2] &= ~bit
+        if card is None:
+            self.known &= ~bit
+        else:
+            self.known |= bit
+            self.ranks[card.id >> 2] |= bit
+        return old
+
+    def set(self, index, card):
+        return self.put(self.slot(index), card)
+
+    def exchange(self, slot, other, other_slot):
+        # swaps what's known about slot with what's known about other_slot of the other hand,
+        # returns the two cards from before
+        card = self.slots[slot]
+        other_card = other.slots[other_slot]
+        # most of the time neither is known and there's nothing to do
+        if card is not None or other_card is not None:
+            self.put(slot, other_card)
+            other.put(other_slot, card)
+        return card, other_card
+
+    def append(self, card):
+        slot = len(self.slots)
+        self.slots.append(card)
+        self.occupied |= 1 << slot
+        if card is not None:
+            self.known |= 1 << slot
+            self.ranks[card.id >> 2] |= 1 << slot
+
+    def add_cards(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def pop(self, index):
+        # takes the card at index out of the hand, returns what was known about it
+        slot = self.slot(index)
+        card = self.slots[slot]
+        self.slots[slot] = None
+        mask = ~(1 << slot)
+        self.occupied &= mask
+        self.known &= mask
+        if card is not None:
+            self.ranks[card.id >> 2] &= mask
+        if not self.occupied:
+            # nothing left, so the slots can start again from the bottom
+            self.slots.clear()
+        return card
+
+    def find_rank(self, rank_index):
+        # index of the first known card with that rank index, None if there isn't one
+        slots = self.ranks[rank_index]
+        if not slots:
+            return None
+        return self.index((slots & -slots).bit_length() - 1)
+
+    def __iter__(self):
+        occupied = self.occupied
+        slots = self.slots
+        while occupied:
+            low = occupied & -occupied
+            yield slots[low.bit_length() - 1]
+            occupied ^= low
+
+    @property
+    def cards(self):
+        # list-like view of the hand in order, with None for the cards that aren't known.
+        # it's what knowledge used to be, a Hand padded with None
+        return KnownCards(self)
+
+    @cards.setter
+    def cards(self, cards):
+        self.clear()
+        self.add_cards(cards)
+
+    def __str__(self):
+        return "".join(str(card) + " " for card in self)
+
+
+class KnownCards(Sequence):
+    # see KnownHand.cards
+    __slots__ = ('hand',)
+
+    def __init__(self, hand):
+        self.hand = hand
+
+    def __len__(self):
+        return len(self.hand)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.hand)[index]
+        return self.hand[index]
+
+    def __setitem__(self, index, card):
+        self.hand.set(index, card)
+
+    def __iter__(self):
+        return iter(self.hand)
+
+    def __eq__(self, other):
+        return isinstance(other, (Sequence, KnownCards)) and list(self) == list(other)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Knowledge:
     def __init__(self):
-        self.opp_hand = Hand()
-        self.own_hand = Hand()
+        self.opp_hand = KnownHand()
+        self.own_hand = KnownHand()
+        # sums of the cards known in each hand, kept up to date by Game
+        self.own_score = 0
+        self.opp_score = 0
+        self.counter = CardCounter()
+
+    def reset(self):
+        self.opp_hand.clear()
+        self.own_hand.clear()
+        self.own_score = 0
+        self.opp_score = 0
+        self.counter.reset()
+
+    def snapshot(self):
+        # see Game.snapshot
+        return (self.own_hand.snapshot(), self.opp_hand.snapshot(), self.own_score, self.opp_score,
+                self.counter.snapshot())
+
+    def restore(self, state):
+        own_hand, opp_hand, self.own_score, self.opp_score, counter = state
+        self.own_hand.restore(own_hand)
+        self.opp_hand.restore(opp_hand)
+        self.counter.restore(counter)
+
+
+# players only need to tell each other apart, so a counter is plenty
+player_ids = count()
+
+# a policy's weights (see strategy.WeightedPlayer):
+#   index 0-13: probability of keeping an Ace - Black King + Red King
+#   index 14: probability of calling cambio
+NUM_WEIGHTS = 15
+CAMBIO_WEIGHT = 14
+
+def weight_index_of_id(card_id):
+    if RANKS[rank_of_id(card_id)] == Rank.KING:
+        return 12 if SUITS[suit_of_id(card_id)] in (Suit.CLUBS, Suit.SPADES) else 13
+    return rank_of_id(card_id)
+
+# weight index of every card id
+WEIGHT_INDEX = tuple(weight_index_of_id(i) for i in range(NUM_CARDS))
+# the same odds as the random Player: keep half the cards, call cambio 10% of the time
+DEFAULT_WEIGHTS = (0.5,) * CAMBIO_WEIGHT + (0.1,)
 
 
 class Player:
-    def __init__(self):
-        self.hand = Hand()
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else random
+        self.hand = Hand(rng)
         self.has_called_cambio = False
         self.knowledge = Knowledge()
-        self.id = uuid4()
+        # real score of the hand, kept up to date by Game
+        self.score = 0
+        self.id = next(player_ids)
     
     def __eq__(self, other):
         return self.id == other.id
+
+    def reset(self):
+        self.hand.cards.clear()
+        self.has_called_cambio = False
+        self.knowledge.reset()
+        self.score = 0
+
+    def snapshot(self):
+        # the player's part of Game.snapshot. a subclass with its own state that changes during a
+        # game should override both of these to add it
+        return tuple(self.hand.cards), self.score, self.has_called_cambio, self.knowledge.snapshot()
+
+    def restore(self, state):
+        cards, self.score, self.has_called_cambio, knowledge = state
+        self.hand.cards[:] = cards
+        self.knowledge.restore(knowledge)
     
     def handle_card(self, card, random_state=None):
         # figure out whether to replace or play this card
-        if random_state is not None:
-            random.seed(random_state)
-        decision = random.random()
+        decision = resolve_rng(self.rng, random_state).random()
         if decision > 0.5:
             return self.replace_card(card)
         else:
@@ -203,13 +639,13 @@ class Player:
         # things to consider: right now, we are *always* favoring to throw away own own cards
         # however, there should be an EV calculation to ask oneself if it's better to throw away own card
         # or better to give the opp an extra card
-        for i, card in enumerate(self.knowledge.own_hand.cards):
-            if card is not None and top_card.rank == card.rank:
-                return Action.DISCARD, None, i
-        for i, card in enumerate(self.knowledge.opp_hand.cards):
-            card = self.knowledge.opp_hand.cards[i]
-            if card is not None and top_card.rank == card.rank:
-                return Action.DISCARD, i, None
+        rank_index = top_card.id >> 2
+        own_index = self.knowledge.own_hand.find_rank(rank_index)
+        if own_index is not None:
+            return Action.DISCARD, None, own_index
+        opp_index = self.knowledge.opp_hand.find_rank(rank_index)
+        if opp_index is not None:
+            return Action.DISCARD, opp_index, None
         return Action.NONE, None, None
 
     def decide_cambio(self, called_cambio, random_state=None):
@@ -218,9 +654,7 @@ class Player:
         if self.knowledge.own_hand.is_empty():
             self.call_cambio()
             return
-        if random_state is not None:
-            random.seed(random_state)
-        decision = random.random()
+        decision = resolve_rng(self.rng, random_state).random()
         if decision > 0.9:
             self.call_cambio()
 
@@ -228,26 +662,182 @@ class Player:
         self.has_called_cambio = True
 
 
-class Game:
+class GameResult(NamedTuple):
+    # what Game.start returns. hands are encode_cards bytes rather than the live Hands so
+    # keeping results around doesn't keep the game alive, and None when the game was started
+    # with capture_hands=False
+    winner: int # 0 for player_one, 1 for player_two
+    player_one_hand: Optional[bytes]
+    player_one_score: int
+    player_two_hand: Optional[bytes]
+    player_two_score: int
+    num_rounds: int
+
+    def player_one_cards(self):
+        return decode_cards(self.player_one_hand)
+
+    def player_two_cards(self):
+        return decode_cards(self.player_two_hand)
+
+
+class GameState(NamedTuple):
+    # everything about a Game that changes while it's played, see Game.snapshot. it's nothing
+    # but tuples, bytes and ints (and the shared CARDS), so it can't be changed after the fact
+    # and any number of games can be restored from one without it ever being copied
+    deck: tuple # the cards still to be dealt, in order
+    discard: tuple
+    reshuffles: int
+    num_rounds: int
+    current_seat: int # seat of current_player, see Game.seat
+    cambio_seat: int # seat of cambio_player, -1 if nobody has called cambio
+    player_one: tuple # Player.snapshot
+    player_two: tuple
+    rng: object # the generator's getstate(), None if it wasn't saved
+
+
+class GameStats:
+    # opt-in instrumentation for Game, see Game(stats=...). counts what happens in each game
+    # and how long each phase takes. merge() adds up the stats of a whole simulation
+    PHASES = ('deal', 'decision', 'action', 'race', 'scoring')
+
     def __init__(self):
-        self.deck = Deck()
-        self.player_one = Player()
-        self.discard = Hand()
-        self.player_two = Player()
+        self.games = 0
+        self.rounds = 0
+        self.actions = Counter()
+        self.races = 0
+        self.race_outcomes = Counter()
+        self.penalties = 0
+        self.reshuffles = 0
+        self.cambio_calls = 0
+        # the swap decisions a SHOW_AND_SWAP asks for after its show, they aren't in actions
+        self.king_swaps = 0
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)
+        self.last_lap = 0.0
+
+    def start_laps(self):
+        self.last_lap = perf_counter()
+
+    def lap(self, phase):
+        # everything since the last lap goes to phase
+        now = perf_counter()
+        self.phase_times[phase] += now - self.last_lap
+        self.last_lap = now
+
+    def record_race(self, outcome, elapsed):
+        self.races += 1
+        self.race_outcomes[outcome] += 1
+        if outcome in PENALTY_OUTCOMES:
+            self.penalties += 1
+        self.phase_times['race'] += elapsed
+        # races happen in the middle of other phases, don't count them twice
+        self.last_lap += elapsed
+
+    def merge(self, other):
+        self.games += other.games
+        self.rounds += other.rounds
+        self.actions.update(other.actions)
+        self.races += other.races
+        self.race_outcomes.update(other.race_outcomes)
+        self.penalties += other.penalties
+        self.reshuffles += other.reshuffles
+        self.cambio_calls += other.cambio_calls
+        self.king_swaps += other.king_swaps
+        for phase in self.PHASES:
+            self.phase_times[phase] += other.phase_times[phase]
+        return self
+
+    def summary(self):
+        return {
+            'games': self.games,
+            'rounds': self.rounds,
+            'actions': {action.value: count for action, count in self.actions.items()},
+            'races': self.races,
+            'race_outcomes': {outcome.value: count for outcome, count in self.race_outcomes.items()},
+            'penalties': self.penalties,
+            'reshuffles': self.reshuffles,
+            'cambio_calls': self.cambio_calls,
+            'king_swaps': self.king_swaps,
+            'phase_times': dict(self.phase_times),
+        }
+
+
+class Game:
+    def __init__(self, rng=None, stats=None, debug=False, player_one=None, player_two=None, log=None,
+                 deck_rng=None, player_rng=None):
+        # every bit of randomness in a game comes from this one generator, so games don't
+        # share any state with each other. anything with random() and shuffle() works,
+        # e.g. a numpy Generator, but start(seed=...) needs it to have seed() as well.
+        # deck_rng and player_rng take the shuffles and the players' decisions off it onto
+        # generators of their own (see batch.split_rngs), start(seed=...) seeds all of them
+        self.rng = rng if rng is not None else random.Random()
+        self.deck = Deck(rng=deck_rng if deck_rng is not None else self.rng)
+        player_rng = self.player_rng = player_rng if player_rng is not None else self.rng
+        # any Player subclass can play, they get switched over to the game's generator
+        self.player_one = player_one if player_one is not None else Player(player_rng)
+        self.discard = Hand(self.rng)
+        self.player_two = player_two if player_two is not None else Player(player_rng)
+        for player in (self.player_one, self.player_two):
+            player.rng = player_rng
+            player.hand.rng = player_rng
         self.num_rounds = 0
         self.current_player = self.player_one
         self.other_player = self.player_two
         self.cambio_player = None # represents the player who called cambio
+        self.stats = stats # a GameStats, or None to skip all of the instrumentation
+        self.log = log # a replay.GameLog to write every game's events to, or None
+        self.action_counts = None # set to a Counter to count this game's actions in it
+        # players' scores are kept up to date as cards move around instead of being added
+        # up again every time. debug checks them against a full recount after every change
+        self.debug = debug
+
+    def reset(self, seed=None):
+        # puts the game back to how __init__ left it, but reuses every object the game already
+        # has, so playing lots of games in a row costs almost nothing to set up
+        self.deck.reset()
+        self.discard.cards.clear()
+        self.player_one.reset()
+        self.player_two.reset()
+        self.num_rounds = 0
+        self.current_player = self.player_one
+        self.other_player = self.player_two
+        self.cambio_player = None
+        if self.action_counts is not None:
+            self.action_counts.clear()
+        if seed is not None:
+            self.seed(seed)
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+        for rng in (self.deck.rng, self.player_rng):
+            if rng is not self.rng:
+                rng.seed(seed)
     
-    def start(self, random_state=None, verbose=False):
-        # shuffle deck
-        self.deck.shuffle(random_state=random_state)
+    def start(self, seed=None, verbose=False, random_state=None, capture_hands=True):
+        # random_state is the old name for seed
+        if seed is None:
+            seed = random_state
+        if seed is not None:
+            self.seed(seed)
+        stats = self.stats
+        if stats is not None:
+            stats.start_laps()
+
+        self.deal_hands()
+        if stats is not None:
+            stats.lap('deal')
+        return self.play(verbose, capture_hands)
+
+    def deal_hands(self):
+        # shuffles, deals and shows everyone their first two cards
+        self.deck.shuffle()
+        if self.log is not None:
+            self.log.start(self.deck.cards)
 
         # deal cards
         self.add_cards(self.current_player, self.other_player, self.deck.deal(4))
         self.add_cards(self.other_player, self.current_player, self.deck.deal(4))
         top_card = self.deck.deal(1)[0]
-        self.discard.add_cards([top_card])
+        self.add_discard(top_card)
 
         # show first 2 cards to each player
         self.show_card(self.player_one, self.player_one, 0)
@@ -258,107 +848,220 @@ class Game:
         # discard race at the beginning
         self.discard_race(top_card)
 
-        called_cambio = False
-        # start play
-        while self.num_rounds < 50:
-            self.num_rounds += 1
-
-            # player decides whether or not to call cambio
-            self.current_player.decide_cambio(called_cambio)
-            if self.current_player.has_called_cambio:
-                # if they do, then allow the loop run one more time
-                self.cambio_player = self.current_player
-                called_cambio = True
-            else:
-                # otherwise, draw a card
-                drawn_card = self.deck.deal(1, self.discard.cards)[0]
-                # player will handle the card
-                action, opp_index, own_index = self.current_player.handle_card(drawn_card)
-                # performs the action the player wants to
-                self.perform_action(action, opp_index, own_index, drawn_card, called_cambio)
-
-                if called_cambio:
-                    break
-                
-            # switch players for the next turn
-            self.current_player = self.player_one if self.num_rounds % 2 == 0 else self.player_two
-            self.other_player = self.player_one if self.num_rounds % 2 == 1 else self.player_two
-        
-        return self.decide_winner(verbose)
+    def play(self, verbose=False, capture_hands=True):
+        # plays the game out from wherever it is between rounds, returns the GameResult
+        while self.num_rounds < MAX_ROUNDS:
+            if self.play_round():
+                break
+        return self.finish(verbose, capture_hands)
+
+    def play_round(self):
+        # plays the next round, returns True if it was the last one
+        called_cambio = self.cambio_player is not None
+        self.num_rounds += 1
+
+        # player decides whether or not to call cambio
+        self.current_player.decide_cambio(called_cambio)
+        if self.current_player.has_called_cambio:
+            return self.cambio_turn()
+        # otherwise, draw a card and the player will handle it
+        drawn_card = self.draw()
+        action, opp_index, own_index = self.current_player.handle_card(drawn_card)
+        return self.finish_turn(drawn_card, action, opp_index, own_index)
+
+    def cambio_turn(self):
+        # current_player has called cambio this round, the other player gets one more
+        stats = self.stats
+        self.cambio_player = self.current_player
+        if stats is not None:
+            stats.cambio_calls += 1
+            stats.lap('decision')
+        if self.log is not None:
+            self.log.cambio(self.seat(self.current_player))
+        self.next_turn()
+        return False
+
+    def draw(self):
+        # current_player draws a card for their turn
+        drawn_card = self.deal(1)[0]
+        self.current_player.knowledge.counter.see(drawn_card)
+        return drawn_card
+
+    def finish_turn(self, drawn_card, action, opp_index, own_index):
+        # the rest of current_player's round once they've decided what to do with drawn_card,
+        # returns True if it was the last round
+        stats = self.stats
+        if self.log is not None:
+            self.log.draw(drawn_card)
+            self.log.action(action, opp_index, own_index)
+        if self.action_counts is not None:
+            self.action_counts[action] += 1
+        if stats is not None:
+            stats.actions[action] += 1
+            stats.lap('decision')
+        # performs the action the player wants to
+        called_cambio = self.cambio_player is not None
+        self.perform_action(action, opp_index, own_index, drawn_card, called_cambio)
+        if stats is not None:
+            stats.lap('action')
+        if called_cambio:
+            return True
+        self.next_turn()
+        return False
+
+    def next_turn(self):
+        # switch players for the next round
+        self.current_player = self.player_one if self.num_rounds % 2 == 0 else self.player_two
+        self.other_player = self.player_one if self.num_rounds % 2 == 1 else self.player_two
+
+    def finish(self, verbose=False, capture_hands=True):
+        # scores the game once nobody is playing any more
+        stats = self.stats
+        if stats is None and self.log is None:
+            return self.decide_winner(verbose, capture_hands)
+        result = self.decide_winner(verbose, capture_hands)
+        if self.log is not None:
+            self.log.end(result.winner, self.num_rounds)
+        if stats is None:
+            return result
+        stats.lap('scoring')
+        stats.games += 1
+        stats.rounds += self.num_rounds
+        stats.reshuffles += self.deck.reshuffles
+        return result
+
+    def snapshot(self, rng=False):
+        # an immutable copy of the game as it is right now, see GameState. restore puts this
+        # game, or any other (see fork), back to it. rng saves the generator's state as well,
+        # so a restored game plays out exactly like this one would from here. it's off by
+        # default because it costs more than the rest of the snapshot put together
+        player_one = self.player_one
+        return GameState(
+            tuple(self.deck.cards[self.deck.top:]), tuple(self.discard.cards), self.deck.reshuffles,
+            self.num_rounds, 0 if self.current_player is player_one else 1,
+            -1 if self.cambio_player is None else self.seat(self.cambio_player),
+            player_one.snapshot(), self.player_two.snapshot(),
+            self.rng.getstate() if rng else None)
+
+    def restore(self, state: GameState):
+        # copies state into the game's own lists, so nothing gets allocated and the state can
+        # be restored from again however the game is played afterwards
+        self.deck.cards[:] = state.deck
+        self.deck.top = 0
+        self.deck.reshuffles = state.reshuffles
+        self.discard.cards[:] = state.discard
+        self.player_one.restore(state.player_one)
+        self.player_two.restore(state.player_two)
+        self.num_rounds = state.num_rounds
+        players = (self.player_one, self.player_two)
+        self.current_player = players[state.current_seat]
+        self.other_player = players[1 - state.current_seat]
+        self.cambio_player = players[state.cambio_seat] if state.cambio_seat >= 0 else None
+        if state.rng is not None:
+            self.rng.setstate(state.rng)
+        if self.debug:
+            self.check_scores()
+
+    def fork(self, rng=None, player_one=None, player_two=None):
+        # a new game in the same position that shares nothing with this one, to play ahead in.
+        # it gets its own generator and players, plain Players unless others are given.
+        # thousands of branches are cheaper as one snapshot restored into the same spare game
+        game = Game(rng=rng, debug=self.debug, player_one=player_one, player_two=player_two)
+        game.restore(self.snapshot())
+        return game
     
     def discard_race(self, card, random_state=None):
-        action_one, opp_index_one, own_index_one = self.current_player.try_discard(card)
-        action_two, opp_index_two, own_index_two = self.other_player.try_discard(card)
-        if action_one == Action.NONE and action_two == Action.NONE:
-            return
-        if action_one == Action.DISCARD and action_two == Action.NONE:
-            # discard the card that current_player wants to do
-            if opp_index_one is not None:
-                self.delete_card(self.other_player, self.current_player, opp_index_one)
-                penalties = self.deck.deal(2)
-                for penalty in penalties:
-                    self.add_card(self.other_player, self.current_player, penalty)
-            if own_index_one is not None:
-                self.delete_card(self.current_player, self.other_player, own_index_one)
+        if self.stats is None:
+            self.run_discard_race(card, random_state)
             return
-        if action_one == Action.NONE and action_two == Action.DISCARD:
-            # discard the card that other_player wants to do
-            if opp_index_two is not None:
-                self.delete_card(self.current_player, self.other_player, opp_index_two)
-                penalties = self.deck.deal(2)
-                for penalty in penalties:
-                    self.add_card(self.current_player, self.other_player, penalty)
-            if own_index_two is not None:
-                self.delete_card(self.other_player, self.current_player, own_index_two)
-            return
-        if action_one == Action.DISCARD and action_two == Action.DISCARD:
-            if random_state is not None:
-                random.seed(random_state)
-            dice_roll = random.random()
-            if opp_index_two is not None and own_index_one is not None:
-                # current_player is playing defense, 0.8 chance to win
-                if dice_roll < 0.8:
-                    # current_player gets to discard own
-                    self.delete_card(self.current_player, self.other_player, own_index_one)
-                else:
-                    # current_player receives penalty
-                    self.delete_card(self.current_player, self.other_player, opp_index_two)
-                    penalties = self.deck.deal(2)
-                    for penalty in penalties:
-                        self.add_card(self.current_player, self.other_player, penalty)
-            if opp_index_one is not None and own_index_two is not None:
-                # other_player is playing defense, 0.8 chance to win
-                if dice_roll < 0.8:
-                    self.delete_card(self.other_player, self.current_player, own_index_two)
-                else:
-                    self.delete_card(self.other_player, self.current_player, opp_index_one)
-                    penalties = self.deck.deal(2)
-                    for penalty in penalties:
-                        self.add_card(self.other_player, self.current_player, penalty)
-            if own_index_one is not None and own_index_two is not None:
-                # it's a flip if both are trying to throw away their own card
-                if dice_roll < 0.5:
-                    self.delete_card(self.current_player, self.other_player, own_index_one)
-                else:
-                    self.delete_card(self.other_player, self.current_player, own_index_two)
-            if opp_index_one is not None and opp_index_two is not None:
-                # it's a flip if both are trying to throw away their opp's card
-                if dice_roll < 0.5:
-                    self.delete_card(self.current_player, self.other_player, opp_index_two)
-                    penalties = self.deck.deal(2)
-                    for penalty in penalties:
-                        self.add_card(self.current_player, self.other_player, penalty)
-                else:
-                    self.delete_card(self.other_player, self.current_player, opp_index_one)
-                    penalties = self.deck.deal(2)
-                    for penalty in penalties:
-                        self.add_card(self.other_player, self.current_player, penalty)
+        start = perf_counter()
+        outcome = self.run_discard_race(card, random_state)
+        self.stats.record_race(outcome, perf_counter() - start)
+
+    def run_discard_race(self, card, random_state=None):
+        # returns the RaceOutcome. a claim is (player, opp, own, index): the card player wants
+        # to throw out, at index of their own hand if own, otherwise of opp's
+        one = self.claim(self.current_player, self.other_player, card)
+        two = self.claim(self.other_player, self.current_player, card)
+        if one is None or two is None:
+            claim = one if two is None else two
+            if claim is None:
+                return RaceOutcome.NONE
+            return self.settle(claim, RaceOutcome.OWN if claim[2] else RaceOutcome.OPP)
+
+        # both claimed it, one dice roll decides. one is current_player's claim
+        dice_roll = resolve_rng(self.rng, random_state).random()
+        if one[2] != two[2]:
+            # whoever is going for their own card is playing defense, 0.8 chance to win
+            defender, attacker = (one, two) if one[2] else (two, one)
+            if dice_roll < 0.8:
+                return self.settle(defender, RaceOutcome.DEFENDED)
+            return self.settle(attacker, RaceOutcome.DEFENSE_BROKEN)
+        if one[2]:
+            # it's a flip if both are trying to throw away their own card
+            return self.settle(one if dice_roll < 0.5 else two, RaceOutcome.OWN_FLIP)
+        # it's a flip if both are trying to throw away their opp's card, current_player gets
+        # the penalty on the low side
+        return self.settle(two if dice_roll < 0.5 else one, RaceOutcome.OPP_FLIP)
+
+    def claim(self, player: Player, opp: Player, card: Card):
+        action, opp_index, own_index = player.try_discard(card)
+        if action != Action.DISCARD:
+            return None
+        if own_index is not None:
+            return player, opp, True, own_index
+        return player, opp, False, opp_index
+
+    def settle(self, claim, outcome: RaceOutcome):
+        # carries out the claim that won the race
+        player, opp, own, index = claim
+        if own:
+            return self.throw_out(player, opp, index, outcome)
+        return self.throw_out(opp, player, index, outcome)
+
+    def throw_out(self, player: Player, opp: Player, index: int, outcome: RaceOutcome):
+        # the end of a race: the card at index of player's hand goes, and player gets the
+        # penalty cards if the outcome has them. returns outcome
+        self.delete_card(player, opp, index)
+        if outcome in PENALTY_OUTCOMES:
+            for penalty in self.deal(2):
+                self.add_card(player, opp, penalty)
+        if self.log is not None:
+            self.log.race(outcome, self.seat(player), index)
+        return outcome
+
+    def seat(self, player: Player):
+        # 0 for player one, 1 for player two
+        return 0 if player is self.player_one else 1
+
+    def deal(self, n):
+        # deals from the deck, shuffling the discard pile back in if it runs out
+        reshuffles = self.deck.reshuffles
+        cards = self.deck.deal(n, self.discard)
+        if self.deck.reshuffles != reshuffles:
+            # nobody knows where the cards from the discard pile are any more
+            for card in self.deck.cards:
+                self.player_one.knowledge.counter.forget(card)
+                self.player_two.knowledge.counter.forget(card)
+            if self.log is not None:
+                self.log.reshuffle(self.deck.cards)
+        return cards
+
+    def add_discard(self, card):
+        # the discard pile is face up, so both players see the card
+        self.discard.add_cards([card])
+        self.player_one.knowledge.counter.see(card)
+        self.player_two.knowledge.counter.see(card)
 
     def show_card(self, player: Player, card_from_player: Player, index):
+        card = card_from_player.hand.cards[index]
+        player.knowledge.counter.see(card)
         if player == card_from_player:
-            player.knowledge.own_hand.cards[index] = card_from_player.hand.cards[index]
+            player.knowledge.own_score += card.score - known_score(player.knowledge.own_hand.set(index, card))
         else:
-            player.knowledge.opp_hand.cards[index] = card_from_player.hand.cards[index]
+            player.knowledge.opp_score += card.score - known_score(player.knowledge.opp_hand.set(index, card))
+        if self.debug:
+            self.check_scores()
         
     def swap_cards(self, player: Player, opp: Player, own_index: int, opp_index: int):
         # world update
@@ -367,24 +1070,28 @@ class Game:
 
         player.hand.cards[own_index] = opp_card
         opp.hand.cards[opp_index] = own_card
+        player.score += opp_card.score - own_card.score
+        opp.score += own_card.score - opp_card.score
 
-        # update own knowledge
-        # own knowledge about own card
-        own_own_card_knowledge = player.knowledge.own_hand.cards[own_index]
-        # own knowledge about opp card
-        own_opp_card_knowledge = player.knowledge.opp_hand.cards[opp_index]
+        # the two cards' slots, which are the same in both players' knowledge of a hand
+        own_slot = player.knowledge.own_hand.slot(own_index)
+        opp_slot = player.knowledge.opp_hand.slot(opp_index)
 
-        player.knowledge.own_hand.cards[own_index] = own_opp_card_knowledge
-        player.knowledge.opp_hand.cards[opp_index] = own_own_card_knowledge
+        # update own knowledge
+        own_own_card_knowledge, own_opp_card_knowledge = \
+            player.knowledge.own_hand.exchange(own_slot, player.knowledge.opp_hand, opp_slot)
+        moved = known_score(own_opp_card_knowledge) - known_score(own_own_card_knowledge)
+        player.knowledge.own_score += moved
+        player.knowledge.opp_score -= moved
 
         # update opp knowledge
-        # opp knowledge about own card
-        opp_own_card_knowledge = opp.knowledge.opp_hand.cards[own_index]
-        # opp knowledge about opp card
-        opp_opp_card_knowledge = opp.knowledge.own_hand.cards[opp_index]
-
-        opp.knowledge.opp_hand.cards[own_index] = opp_opp_card_knowledge
-        opp.knowledge.own_hand.cards[opp_index] = opp_own_card_knowledge
+        opp_opp_card_knowledge, opp_own_card_knowledge = \
+            opp.knowledge.own_hand.exchange(opp_slot, opp.knowledge.opp_hand, own_slot)
+        moved = known_score(opp_own_card_knowledge) - known_score(opp_opp_card_knowledge)
+        opp.knowledge.own_score += moved
+        opp.knowledge.opp_score -= moved
+        if self.debug:
+            self.check_scores()
 
     def replace_card(self, player: Player, opp: Player, index: int, card: Card):
         old_card = self.delete_card(player, opp, index)
@@ -395,22 +1102,56 @@ class Game:
         card = player.hand.cards[index]
         # world update
         del player.hand.cards[index]
+        player.score -= card.score
+        # cards only ever leave a hand face up
+        player.knowledge.counter.see(card)
+        opp.knowledge.counter.see(card)
         # player knowledge update
-        del player.knowledge.own_hand.cards[index]
+        player.knowledge.own_score -= known_score(player.knowledge.own_hand.pop(index))
         # opp knowledge update
-        del opp.knowledge.opp_hand.cards[index]
+        opp.knowledge.opp_score -= known_score(opp.knowledge.opp_hand.pop(index))
+        if self.debug:
+            self.check_scores()
         return card
 
     def add_card(self, player: Player, opp: Player, card: Card, known_card=False):
         # world update
         player.hand.add_cards([card])
+        player.score += card.score
         # player knowledge update
         if known_card:
-            player.knowledge.own_hand.add_cards([card])
+            player.knowledge.own_hand.append(card)
+            player.knowledge.own_score += card.score
+            player.knowledge.counter.see(card)
         else:
-            player.knowledge.own_hand.add_cards([None])
+            player.knowledge.own_hand.append(None)
         # opp knowledge update
-        opp.knowledge.opp_hand.add_cards([None])
+        opp.knowledge.opp_hand.append(None)
+        if self.debug:
+            self.check_scores()
+
+    def check_scores(self):
+        # recounts every score from scratch and complains if the running ones are off
+        for player in (self.player_one, self.player_two):
+            knowledge = player.knowledge
+            expected = (get_score(player),
+                        sum(known_score(card) for card in knowledge.own_hand.cards),
+                        sum(known_score(card) for card in knowledge.opp_hand.cards))
+            actual = (player.score, knowledge.own_score, knowledge.opp_score)
+            if actual != expected:
+                raise AssertionError(f"running scores (score, own, opp) {actual} don't match recount {expected}")
+        # both players' knowledge of a hand has to use the same slots for it, see swap_cards
+        if self.player_one.knowledge.own_hand.occupied != self.player_two.knowledge.opp_hand.occupied \
+                or self.player_two.knowledge.own_hand.occupied != self.player_one.knowledge.opp_hand.occupied:
+            raise AssertionError("players' knowledge of a hand is in different slots")
+        for player in (self.player_one, self.player_two):
+            for hand in (player.knowledge.own_hand, player.knowledge.opp_hand):
+                ranks = [0] * len(RANKS)
+                for slot, card in enumerate(hand.slots):
+                    if card is not None:
+                        ranks[card.id >> 2] |= 1 << slot
+                if ranks != hand.ranks:
+                    raise AssertionError("known slots by rank don't match the slots")
     
     def add_cards(self, player: Player, opp: Player, cards: List[Card], known_cards=False):
         [self.add_card(player, opp, card, known_card=known_cards) for card in cards]
@@ -420,7 +1161,7 @@ class Game:
             return
         if action == Action.REPLACE:
             old_card = self.replace_card(self.current_player, self.other_player, own_index, drawn_card)
-            self.discard.add_cards([old_card])
+            self.add_discard(old_card)
             self.discard_race(old_card)
         else:
             if action == Action.SHOW:
@@ -434,15 +1175,19 @@ class Game:
                 self.show_card(self.current_player, self.other_player, opp_index)
                 if not called_cambio:
                     action, opp_index, own_index = self.current_player.play_card(Card(Rank.JACK, Suit.SPADES)) # little bit jank, it passes it back as a Jack to swap
+                    if self.log is not None:
+                        self.log.swap(opp_index, own_index)
+                    if self.stats is not None:
+                        self.stats.king_swaps += 1
                     self.swap_cards(self.current_player, self.other_player, own_index, opp_index)
-            self.discard.add_cards([drawn_card])
+            self.add_discard(drawn_card)
             self.discard_race(drawn_card)
 
-    def decide_winner(self, verbose):
+    def decide_winner(self, verbose, capture_hands=True):
         # other things to log: num of each action
-        # returns winner (0 for player_one, 1 for player_two), player_one hand, player_one_score, player_two hand, player_two_score num_rounds
-        player_one_score = get_score(self.player_one)
-        player_two_score = get_score(self.player_two)
+        # returns a GameResult. bulk simulations pass capture_hands=False to skip the hands
+        player_one_score = self.player_one.score
+        player_two_score = self.player_two.score
         
 
         if player_one_score < player_two_score:
@@ -456,7 +1201,7 @@ class Game:
                 winner = 1
         
         if verbose:
-            print(f"PLAYER {"ONE" if winner == 0 else "TWO"} WINS!")
+            print(f"PLAYER {'ONE' if winner == 0 else 'TWO'} WINS!")
             print("Stats")
             print("----")
             print(f"Player one cards: {self.player_one.hand}")
@@ -464,4 +1209,7 @@ class Game:
             print(f"Player two cards: {self.player_two.hand}")
             print(f"Player two score: {player_two_score}")
             print(f"Number of rounds: {self.num_rounds}")
-        return winner, self.player_one.hand, player_one_score, self.player_two.hand, player_two_score, self.num_rounds
+        if not capture_hands:
+            return GameResult(winner, None, player_one_score, None, player_two_score, self.num_rounds)
+        return GameResult(winner, encode_cards(self.player_one.hand.cards), player_one_score,
+                          encode_cards(self.player_two.hand.cards), player_two_score, self.num_rounds)
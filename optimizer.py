@@ -0,0 +1,167 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from models import DEFAULT_WEIGHTS, NUM_WEIGHTS
+from strategy import tournament, fitness
+
+
+def play_tournament(weights, seeds):
+    # top level so the process pool can pickle it
+    return tournament(weights, seeds)[0]
+
+
+class GeneticOptimizer:
+    # evolves WeightedPlayer weights through self-play. every generation the whole population
+    # (plus the anchors, which never change, so there's something fixed to measure against)
+    # plays a tournament on that generation's seeds, and the next generation is the elite
+    # plus mutated crossovers of the fitter half. everything random comes from
+    # (seed, generation), so a run resumed from a checkpoint carries on exactly where it stopped
+    def __init__(self, population_size=16, seeds_per_generation=200, elite=4, mutation_scale=0.1,
+                 seed=0, num_workers=None, checkpoint_path=None, anchors=(DEFAULT_WEIGHTS,)):
+        self.population_size = population_size
+        self.seeds_per_generation = seeds_per_generation
+        self.elite = elite
+        self.mutation_scale = mutation_scale
+        self.seed = seed
+        self.num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        self.checkpoint_path = checkpoint_path
+        self.anchors = np.asarray(anchors, dtype=float).reshape(-1, NUM_WEIGHTS)
+
+        self.generation = 0
+        self.population = np.random.default_rng([seed]).random((population_size, NUM_WEIGHTS))
+        # one entry per finished generation
+        self.history = []
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load(checkpoint_path)
+
+    def generation_seeds(self, generation):
+        # the same every time for a given generation, so a resumed run plays the same games
+        rng = np.random.default_rng([self.seed, generation, 1])
+        return rng.integers(0, 2 ** 31, self.seeds_per_generation)
+
+    def final_seeds(self):
+        # seeds of their own, not any generation's, for best_weights
+        rng = np.random.default_rng([self.seed, 0, 3])
+        return rng.integers(0, 2 ** 31, self.seeds_per_generation)
+
+    def evaluate(self, population, generation, pool=None):
+        return self.evaluate_on(population, self.generation_seeds(generation), pool)
+
+    def evaluate_on(self, population, seeds, pool=None):
+        # each candidate's win rate against the rest of the population and the anchors
+        weights = np.concatenate([population, self.anchors])
+        # the seeds get split up between the workers and the wins added back up
+        chunks = [chunk for chunk in np.array_split(seeds, self.num_workers * 2) if len(chunk)]
+        if pool is None:
+            results = [play_tournament(weights, chunk) for chunk in chunks]
+        else:
+            results = pool.map(play_tournament, [weights] * len(chunks), chunks)
+        wins = sum(results)
+        return fitness(wins, 2 * len(seeds))[:len(population)]
+
+    def next_population(self, population, scores, generation):
+        rng = np.random.default_rng([self.seed, generation, 2])
+        order = np.argsort(-scores, kind='stable')
+        elite = population[order[:self.elite]]
+        parents = population[order[:max(2, len(population) // 2)]]
+
+        num_children = len(population) - len(elite)
+        mothers = parents[rng.integers(0, len(parents), num_children)]
+        fathers = parents[rng.integers(0, len(parents), num_children)]
+        # uniform crossover, then gaussian mutation
+        children = np.where(rng.random((num_children, NUM_WEIGHTS)) < 0.5, mothers, fathers)
+        children = children + rng.normal(0, self.mutation_scale, children.shape)
+        return np.concatenate([elite, np.clip(children, 0, 1)])
+
+    def step(self, pool=None):
+        start = time.perf_counter()
+        scores = self.evaluate(self.population, self.generation, pool)
+        elapsed = time.perf_counter() - start
+
+        k = len(self.population) + len(self.anchors)
+        games = k * (k - 1) * self.seeds_per_generation
+        best = int(np.argmax(scores))
+        report = {
+            'generation': self.generation,
+            'best_fitness': float(scores[best]),
+            'mean_fitness': float(scores.mean()),
+            'best_weights': self.population[best].tolist(),
+            'games': games,
+            'games_per_sec': games / elapsed,
+        }
+        self.history.append(report)
+        self.population = self.next_population(self.population, scores, self.generation)
+        self.generation += 1
+        if self.checkpoint_path is not None:
+            self.save(self.checkpoint_path)
+        return report
+
+    def run(self, generations, callback=None):
+        # runs until `generations` generations have been done in total, counting any from a
+        # checkpoint. callback gets each generation's report. returns best_weights()
+        pool = ProcessPoolExecutor(max_workers=self.num_workers) if self.num_workers > 1 else None
+        try:
+            while self.generation < generations:
+                report = self.step(pool)
+                if callback is not None:
+                    callback(report)
+            return self.best_weights(pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def best_weights(self, pool=None):
+        # a generation's best_fitness is against that generation's field on its own seeds, so
+        # they can't be compared across generations. the best of every generation play each
+        # other (and the anchors) on final_seeds instead, and the winner of that is returned
+        if not self.history:
+            return None
+        candidates = np.unique(np.array([report['best_weights'] for report in self.history]), axis=0)
+        if len(candidates) == 1:
+            return candidates[0]
+        scores = self.evaluate_on(candidates, self.final_seeds(), pool)
+        return candidates[int(np.argmax(scores))]
+
+    def settings(self):
+        # what a checkpoint has to have been made with to carry on from it. anything else would
+        # change the population's shape or make the fitnesses in the history mean something else
+        return {
+            'seed': self.seed,
+            'population_size': self.population_size,
+            'seeds_per_generation': self.seeds_per_generation,
+            'anchors': self.anchors.tolist(),
+        }
+
+    def save(self, path):
+        state = {
+            **self.settings(),
+            'generation': self.generation,
+            'population': self.population.tolist(),
+            'history': self.history,
+        }
+        # write to the side and swap it in, so getting killed mid-write can't lose the checkpoint
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        for name, value in self.settings().items():
+            # older checkpoints only have the seed
+            if name in state and state[name] != value:
+                raise ValueError(f"checkpoint {path} is for {name} {state[name]}, not {value}")
+        self.generation = state['generation']
+        self.population = np.array(state['population'])
+        self.history = state['history']
+
+
+if __name__ == '__main__':
+    optimizer = GeneticOptimizer(checkpoint_path='optimizer_checkpoint.json')
+    optimizer.run(50, callback=lambda report: print(
+        f"generation {report['generation']}: best {report['best_fitness']:.4f} "
+        f"mean {report['mean_fitness']:.4f} ({report['games_per_sec']:,.0f} games/s)"))
+    print(optimizer.best_weights())
@@ -0,0 +1,77 @@
+import math
+import sys
+import time
+from datetime import timedelta
+
+# progress of a long simulation. it's fed whole chunks of games as they finish, never single
+# games, and only writes a line every `interval` seconds, so it costs nothing next to the games
+
+
+class Progress:
+    def __init__(self, total_games, interval=1.0, out=None, clock=time.monotonic):
+        self.total_games = total_games
+        self.interval = interval
+        self.out = out if out is not None else sys.stderr
+        self.clock = clock
+        self.started = clock()
+        self.last_report = None
+        self.reported_games = None
+        # games that were done before this run started, e.g. from a checkpoint
+        self.initial_games = 0
+        self.games = 0
+        # worker id: [games, seconds spent playing them]
+        self.workers = {}
+
+    def resume_from(self, games):
+        self.initial_games = games
+        self.games = games
+
+    def update(self, games, worker=None, elapsed=None):
+        # games more are done. worker and elapsed are who played them and how long it took
+        self.games += games
+        if worker is not None:
+            counts = self.workers.setdefault(worker, [0, 0.0])
+            counts[0] += games
+            counts[1] += elapsed
+        now = self.clock()
+        if self.last_report is None or now - self.last_report >= self.interval:
+            self.report(now)
+
+    def games_per_sec(self):
+        elapsed = self.clock() - self.started
+        return (self.games - self.initial_games) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # seconds left at the rate so far
+        rate = self.games_per_sec()
+        return (self.total_games - self.games) / rate if rate else math.inf
+
+    def worker_rates(self):
+        # games per second each worker manages while it's playing
+        return {worker: games / seconds if seconds else 0.0 for worker, (games, seconds) in self.workers.items()}
+
+    def snapshot(self):
+        return {
+            'games': self.games,
+            'total_games': self.total_games,
+            'games_per_sec': self.games_per_sec(),
+            'eta': self.eta(),
+            'worker_games_per_sec': self.worker_rates(),
+        }
+
+    def report(self, now=None):
+        self.last_report = now if now is not None else self.clock()
+        self.reported_games = self.games
+        eta = self.eta()
+        line = (f"{self.games:,}/{self.total_games:,} games ({self.games / max(self.total_games, 1):.1%}), "
+                f"{self.games_per_sec():,.0f} games/s, "
+                f"eta {'?' if math.isinf(eta) else timedelta(seconds=round(eta))}")
+        if len(self.workers) > 1:
+            rates = sorted(self.worker_rates().values(), reverse=True)
+            line += f", {len(rates)} workers at {' '.join(f'{rate:,.0f}' for rate in rates)} games/s"
+        print(line, file=self.out, flush=True)
+
+    def close(self):
+        # the last line, unless it's already been written
+        if self.reported_games != self.games:
+            self.report()
@@ -0,0 +1,252 @@
+from collections import deque
+import numpy as np
+from models import Action, CARDS, Game, PENALTY_OUTCOMES, RaceOutcome
+
+# games can write everything that happens in them to a GameLog (Game(log=...)), and Replayer
+# plays the log back into a Game without asking the players anything. the log is a flat run
+# of 4 byte records, (kind, a, b, c), so a file of millions of games can be memory mapped with
+# load_log and scanned with numpy:
+#   START                   a game starts, followed by DECK records with the shuffled deck
+#   DECK      card card card   the deck in order, 3 cards a record, padded with NO_CARD
+#   RESHUFFLE               the discard pile went back into the deck, followed by DECK records
+#   DRAW      card          the current player drew card
+#   ACTION    action opp own   what the current player did with it (NO_INDEX for no index)
+#   SWAP      opp own       the swap half of a SHOW_AND_SWAP
+#   RACE      outcome seat index   seat threw out (or lost) the card at index in their hand
+#   CAMBIO    seat          seat called cambio
+#   END       winner rounds
+
+EVENT_DTYPE = np.dtype([('kind', 'u1'), ('a', 'u1'), ('b', 'u1'), ('c', 'u1')])
+
+START = 0
+DECK = 1
+RESHUFFLE = 2
+DRAW = 3
+ACTION = 4
+SWAP = 5
+RACE = 6
+CAMBIO = 7
+END = 8
+
+NO_CARD = 255
+NO_INDEX = 255
+
+ACTIONS = tuple(Action)
+ACTION_CODE = {action: code for code, action in enumerate(ACTIONS)}
+OUTCOMES = tuple(RaceOutcome)
+OUTCOME_CODE = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+
+def index_code(index):
+    return NO_INDEX if index is None else index
+
+
+def index_of_code(code):
+    return None if code == NO_INDEX else code
+
+
+class GameLog:
+    # append-only event log, see above. with a path, events are buffered and appended to the
+    # file every buffer_size bytes (and on flush/close), otherwise they stay in memory
+    def __init__(self, path=None, buffer_size=1 << 16):
+        self.path = path
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.file = open(path, 'ab') if path is not None else None
+
+    def record(self, kind, a=0, b=0, c=0):
+        self.buffer += bytes((kind, a, b, c))
+        if self.file is not None and len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def record_deck(self, kind, cards):
+        self.record(kind)
+        ids = bytes(card.id for card in cards) + bytes((NO_CARD,)) * (-len(cards) % 3)
+        # the DECK records get put together with slices, one record() each is slow for 52 cards
+        records = bytearray(len(ids) // 3 * 4)
+        records[0::4] = bytes((DECK,)) * (len(ids) // 3)
+        records[1::4] = ids[0::3]
+        records[2::4] = ids[1::3]
+        records[3::4] = ids[2::3]
+        self.buffer += records
+
+    def start(self, deck_cards):
+        self.record_deck(START, deck_cards)
+
+    def reshuffle(self, deck_cards):
+        self.record_deck(RESHUFFLE, deck_cards)
+
+    def draw(self, card):
+        self.record(DRAW, card.id)
+
+    def action(self, action, opp_index, own_index):
+        self.record(ACTION, ACTION_CODE[action], index_code(opp_index), index_code(own_index))
+
+    def swap(self, opp_index, own_index):
+        self.record(SWAP, opp_index, own_index)
+
+    def race(self, outcome, seat, index):
+        self.record(RACE, OUTCOME_CODE[outcome], seat, index)
+
+    def cambio(self, seat):
+        self.record(CAMBIO, seat)
+
+    def end(self, winner, num_rounds):
+        self.record(END, winner, num_rounds)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def events(self):
+        # everything logged so far, as an array of EVENT_DTYPE
+        if self.path is None:
+            return np.frombuffer(bytes(self.buffer), dtype=EVENT_DTYPE)
+        self.flush()
+        return load_log(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_log(path):
+    # memory maps a log file, nothing gets read until it's used
+    return np.memmap(path, dtype=EVENT_DTYPE, mode='r')
+
+
+def count_actions(events):
+    # how many times each Action was taken over the whole log
+    codes = events['a'][events['kind'] == ACTION]
+    counts = np.bincount(codes, minlength=len(ACTIONS))
+    return {action: int(counts[code]) for code, action in enumerate(ACTIONS)}
+
+
+class ReplayRandom:
+    # stands in for the replayed game's rng: every shuffle puts the cards in the next order
+    # from the log, and nothing else is allowed to ask for random numbers
+    def __init__(self, decks):
+        self.decks = deque(decks)
+
+    def shuffle(self, x):
+        cards = self.decks.popleft()
+        if sorted(card.id for card in x) != sorted(card.id for card in cards):
+            raise ValueError("logged deck doesn't match the cards being shuffled")
+        x[:] = cards
+
+    def random(self):
+        raise RuntimeError("a replay doesn't roll anything, every outcome comes from the log")
+
+
+class Replayer:
+    def __init__(self, events):
+        self.events = events
+        self.starts = np.flatnonzero(events['kind'] == START)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def game_events(self, i):
+        stop = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.events)
+        return self.events[self.starts[i]: stop]
+
+    def results(self):
+        # (winners, num_rounds) of every finished game, straight off the END records
+        ends = self.events[self.events['kind'] == END]
+        return ends['a'].astype(np.int64), ends['b'].astype(np.int64)
+
+    def replay(self, i, until=None):
+        # game i rebuilt from its log, after the deal and the first `until` events of the game
+        # (all of them if until is None). the events are the DRAW, ACTION, RACE and CAMBIO
+        # records, with a SHOW_AND_SWAP's SWAP counted as part of its ACTION. the Game's
+        # players never get asked for a decision
+        records = self.game_events(i).tolist()
+        # every deck order the game had, even the ones past `until`
+        decks = []
+        for kind, a, b, c in records:
+            if kind in (START, RESHUFFLE):
+                decks.append([])
+            elif kind == DECK:
+                decks[-1].extend(CARDS[code] for code in (a, b, c) if code != NO_CARD)
+        game = Game(rng=ReplayRandom(decks))
+        # the deck records are only there for the decks, and a SWAP is part of the ACTION before it
+        records = [record for record in records if record[0] not in (START, DECK, RESHUFFLE)]
+        if until is not None:
+            events = [j for j, record in enumerate(records) if record[0] != SWAP]
+            if until < len(events):
+                records = records[:events[until]]
+
+        # the deal, same as Game.start
+        game.deck.shuffle()
+        game.add_cards(game.current_player, game.other_player, game.deck.deal(4))
+        game.add_cards(game.other_player, game.current_player, game.deck.deal(4))
+        game.add_discard(game.deck.deal(1)[0])
+        for player in (game.player_one, game.player_two):
+            game.show_card(player, player, 0)
+            game.show_card(player, player, 1)
+
+        players = (game.player_one, game.player_two)
+        called_cambio = False
+        drawn_card = None
+        records = iter(records)
+        for kind, a, b, c in records:
+            if kind in (DRAW, CAMBIO):
+                # both start a new round
+                game.num_rounds += 1
+                game.current_player = game.player_one if game.num_rounds % 2 == 1 else game.player_two
+                game.other_player = game.player_two if game.num_rounds % 2 == 1 else game.player_one
+            if kind == CAMBIO:
+                players[a].call_cambio()
+                game.cambio_player = players[a]
+                called_cambio = True
+            elif kind == DRAW:
+                drawn_card = game.deal(1)[0]
+                if drawn_card.id != a:
+                    raise ValueError(f"replay drew {drawn_card}, the log has {CARDS[a]}")
+                game.current_player.knowledge.counter.see(drawn_card)
+            elif kind == ACTION:
+                swap = None
+                if ACTIONS[a] == Action.SHOW_AND_SWAP and not called_cambio:
+                    _, opp_index, own_index, _ = next(records)
+                    swap = (opp_index, own_index)
+                self.apply_action(game, ACTIONS[a], index_of_code(b), index_of_code(c), drawn_card,
+                                  called_cambio, swap)
+            elif kind == RACE:
+                player, opp = players[b], players[1 - b]
+                game.delete_card(player, opp, c)
+                if OUTCOMES[a] in PENALTY_OUTCOMES:
+                    for penalty in game.deal(2):
+                        game.add_card(player, opp, penalty)
+        return game
+
+    @staticmethod
+    def apply_action(game, action, opp_index, own_index, drawn_card, called_cambio, swap):
+        # Game.perform_action, with the races left to their own RACE records
+        if action == Action.NONE:
+            return
+        if action == Action.REPLACE:
+            game.add_discard(game.replace_card(game.current_player, game.other_player, own_index, drawn_card))
+            return
+        if action == Action.SHOW:
+            if opp_index is not None:
+                game.show_card(game.current_player, game.other_player, opp_index)
+            if own_index is not None:
+                game.show_card(game.current_player, game.current_player, own_index)
+        if action == Action.SWAP and not called_cambio:
+            game.swap_cards(game.current_player, game.other_player, own_index, opp_index)
+        if action == Action.SHOW_AND_SWAP:
+            game.show_card(game.current_player, game.other_player, opp_index)
+            if swap is not None:
+                swap_opp_index, swap_own_index = swap
+                game.swap_cards(game.current_player, game.other_player, swap_own_index, swap_opp_index)
+        game.add_discard(drawn_card)
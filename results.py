@@ -0,0 +1,122 @@
+import json
+import os
+import numpy as np
+from models import Action
+
+# per-game results on disk, one column a file, so a run of any size can be loaded lazily with
+# load_results and analysed a column at a time. a results directory has columns.json with
+# the column layout, and <column>.bin with the raw values of each column, in seed order.
+# run_simulation(output=...) writes one of these
+
+# the actions a player can take with a drawn card, in the order of the actions column
+ACTIONS = (Action.NONE, Action.REPLACE, Action.SHOW, Action.SWAP, Action.SHOW_AND_SWAP)
+ACTION_INDEX = {action: i for i, action in enumerate(ACTIONS)}
+
+# name: (dtype, shape of one row)
+COLUMNS = {
+    'seed': ('int64', ()),
+    'winner': ('int8', ()),
+    'player_one_score': ('int16', ()),
+    'player_two_score': ('int16', ()),
+    'num_rounds': ('int8', ()),
+    # 0 or 1 for the player who called cambio, -1 if nobody did
+    'cambio_caller': ('int8', ()),
+    # how many times each of ACTIONS was taken
+    'actions': ('uint8', (len(ACTIONS),)),
+}
+
+
+def empty_columns(n=0):
+    return {name: np.zeros((n,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+
+
+def concatenate_columns(chunks):
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}
+
+
+class ResultsWriter:
+    # appends chunks of per-game columns to a results directory. chunks are held in memory until
+    # buffer_rows games have built up and then written out together, so the writes are few
+    # and big. an existing directory gets added to, after cutting it down to its first
+    # num_rows rows if num_rows is given
+    def __init__(self, path, buffer_rows=1 << 16, num_rows=None):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        self.buffered_rows = 0
+        os.makedirs(path, exist_ok=True)
+        layout = {name: [dtype, list(shape)] for name, (dtype, shape) in COLUMNS.items()}
+        with open(os.path.join(path, 'columns.json'), 'w') as f:
+            json.dump(layout, f)
+        if num_rows is not None:
+            self.truncate(num_rows)
+        self.files = {name: open(os.path.join(path, f'{name}.bin'), 'ab') for name in COLUMNS}
+
+    def truncate(self, num_rows):
+        for name, (dtype, shape) in COLUMNS.items():
+            path = os.path.join(self.path, f'{name}.bin')
+            size = num_rows * np.dtype(dtype).itemsize * int(np.prod(shape))
+            if (os.path.getsize(path) if os.path.exists(path) else 0) < size:
+                raise ValueError(f"{path} has fewer than {num_rows} rows")
+            with open(path, 'ab') as f:
+                f.truncate(size)
+
+    def add(self, columns):
+        self.buffer.append(columns)
+        self.buffered_rows += len(columns['seed'])
+        if self.buffered_rows >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = concatenate_columns(self.buffer)
+        for name, f in self.files.items():
+            f.write(np.ascontiguousarray(columns[name], dtype=COLUMNS[name][0]).tobytes())
+            f.flush()
+        self.buffer = []
+        self.buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def count_rows(path, layout=None):
+    # how many rows every column of a results directory has, 0 if there isn't one yet
+    if layout is None:
+        if not os.path.exists(os.path.join(path, 'columns.json')):
+            return 0
+        with open(os.path.join(path, 'columns.json')) as f:
+            layout = json.load(f)
+    sizes = []
+    for name, (dtype, shape) in layout.items():
+        row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+        column_path = os.path.join(path, f'{name}.bin')
+        sizes.append(os.path.getsize(column_path) // row_bytes if os.path.exists(column_path) else 0)
+    return min(sizes, default=0)
+
+
+def load_results(path):
+    # {column: array} for a results directory. the arrays are memory mapped, so nothing is
+    # read until it's used. if a write was cut off, only the rows every column has are kept
+    with open(os.path.join(path, 'columns.json')) as f:
+        layout = json.load(f)
+    num_games = count_rows(path, layout)
+
+    columns = {}
+    for name, (dtype, shape) in layout.items():
+        if num_games == 0:
+            columns[name] = np.zeros((0,) + tuple(shape), dtype=dtype)
+            continue
+        columns[name] = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r',
+                                  shape=(num_games,) + tuple(shape))
+    return columns
@@ -0,0 +1,194 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from models import Action, DEFAULT_WEIGHTS, Game, Rank, known_score
+from stats import wilson_interval
+from strategy import WeightedPlayer
+
+# monte carlo evaluation of a player's decisions in the middle of a game. the player can't see
+# the face down cards they haven't looked at or the deck, so each rollout first deals those out
+# again at random (determinize), then plays the game to the end once per candidate from there.
+# every candidate gets the same deals and the same random numbers, so the differences between
+# their win rates are down to the candidates and not to luck
+
+
+def determinize(game, state, seat, rng):
+    # restores state into game with every card seat can't see dealt out again at random: the face
+    # down cards they don't know and the whole deck. the opp's knowledge follows the new cards,
+    # so the opp still only knows about cards that are really there
+    game.restore(state)
+    players = (game.player_one, game.player_two)
+    player, opp = players[seat], players[1 - seat]
+    own_cards = player.hand.cards
+    opp_cards = opp.hand.cards
+    own_hidden = [i for i, card in enumerate(player.knowledge.own_hand) if card is None]
+    opp_hidden = [i for i, card in enumerate(player.knowledge.opp_hand) if card is None]
+
+    pool = [own_cards[i] for i in own_hidden] + [opp_cards[i] for i in opp_hidden] + game.deck.cards
+    rng.shuffle(pool)
+    for i in own_hidden:
+        own_cards[i] = pool.pop()
+    for i in opp_hidden:
+        opp_cards[i] = pool.pop()
+    game.deck.cards[:] = pool
+    player.score = sum(card.score for card in own_cards)
+    opp.score = sum(card.score for card in opp_cards)
+
+    knowledge = opp.knowledge
+    counter = knowledge.counter
+    moved = []
+    for hand, cards in ((knowledge.own_hand, opp_cards), (knowledge.opp_hand, own_cards)):
+        for i, card in enumerate(list(hand)):
+            if card is not None and card != cards[i]:
+                hand.set(i, cards[i])
+                moved.append((card, cards[i]))
+    # all of the old cards go before any of the new ones are seen, a new card can be one the
+    # opp knew somewhere else
+    for card, _ in moved:
+        counter.forget(card)
+    for _, card in moved:
+        counter.see(card)
+    knowledge.own_score = sum(known_score(card) for card in knowledge.own_hand)
+    knowledge.opp_score = sum(known_score(card) for card in knowledge.opp_hand)
+    if game.debug:
+        game.check_scores()
+
+
+def draw_candidates(drawn_card, own_count, opp_count, called_cambio=False):
+    # every (action, opp_index, own_index) a player with own_count cards, against opp_count, can
+    # take with drawn_card, i.e. everything handle_card could sensibly give back
+    candidates = [(Action.NONE, None, None)]
+    candidates += [(Action.REPLACE, None, own_index) for own_index in range(own_count)]
+    rank = drawn_card.rank
+    if rank == Rank.SEVEN or rank == Rank.EIGHT:
+        candidates += [(Action.SHOW, opp_index, None) for opp_index in range(opp_count)]
+    if rank == Rank.NINE or rank == Rank.TEN:
+        candidates += [(Action.SHOW, None, own_index) for own_index in range(own_count)]
+    if (rank == Rank.JACK or rank == Rank.QUEEN) and not called_cambio:
+        # there's no swapping after cambio, so it would be the same as NONE
+        candidates += [(Action.SWAP, opp_index, own_index)
+                       for opp_index in range(opp_count) for own_index in range(own_count)]
+    if rank == Rank.KING:
+        candidates += [(Action.SHOW_AND_SWAP, opp_index, None) for opp_index in range(opp_count)]
+    return candidates
+
+
+def play_out(game, drawn_card, candidate):
+    # plays the game to the end after current_player takes candidate, returns the winner's seat.
+    # with a drawn_card candidate is what to do with it, without one the game is at the start of
+    # current_player's round and candidate is whether they call cambio
+    if drawn_card is not None:
+        over = game.finish_turn(drawn_card, *candidate)
+    else:
+        game.num_rounds += 1
+        if candidate:
+            game.current_player.call_cambio()
+            over = game.cambio_turn()
+        else:
+            drawn = game.draw()
+            over = game.finish_turn(drawn, *game.current_player.handle_card(drawn))
+    if over:
+        return game.finish(capture_hands=False).winner
+    return game.play(capture_hands=False).winner
+
+
+def play_rollouts(state, seat, drawn_card, candidates, seeds, weights, deadline=None):
+    # top level so the process pool can pickle it. one determinization per seed, and every
+    # candidate played out once from each with the same random numbers. no more seeds get
+    # started once time.time() is past deadline. returns the wins of each candidate and the
+    # number of seeds played
+    game = Game(player_one=WeightedPlayer(weights), player_two=WeightedPlayer(weights))
+    wins = [0] * len(candidates)
+    played = 0
+    for seed in seeds:
+        if deadline is not None and time.time() >= deadline:
+            break
+        rng = random.Random(seed)
+        determinize(game, state, seat, rng)
+        dealt = game.snapshot()
+        play_seed = rng.getrandbits(32)
+        for i, candidate in enumerate(candidates):
+            game.restore(dealt)
+            game.rng.seed(play_seed)
+            wins[i] += play_out(game, drawn_card, candidate) == seat
+        played += 1
+    return wins, played
+
+
+class RolloutEvaluator:
+    # estimates the win probability of each choice current_player has, see evaluate. up to
+    # `rollouts` determinizations are played out per decision, spread across num_workers
+    # processes in batches of batch_size, and with a time_limit everything stops once that
+    # many seconds are up. the rollouts are played by WeightedPlayers with weights on both sides
+    def __init__(self, rollouts=200, time_limit=None, num_workers=1, batch_size=None, weights=DEFAULT_WEIGHTS,
+                 seed=None):
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        # a few batches a worker, so a slow one doesn't hold everything up at the end
+        self.batch_size = batch_size if batch_size is not None else max(1, math.ceil(rollouts / (4 * self.num_workers)))
+        self.weights = weights
+        self.rng = random.Random(seed)
+        # the pool is started once and kept, starting one per decision would be slower than
+        # most of the decisions
+        self.pool = ProcessPoolExecutor(max_workers=self.num_workers) if self.num_workers > 1 else None
+
+    def evaluate_draw(self, game, drawn_card, candidates=None):
+        # current_player has drawn drawn_card (see Game.draw) and has to decide what to do with it
+        if candidates is None:
+            knowledge = game.current_player.knowledge
+            candidates = draw_candidates(drawn_card, len(knowledge.own_hand), len(knowledge.opp_hand),
+                                         game.cambio_player is not None)
+        return self.evaluate(game, drawn_card, candidates)
+
+    def evaluate_cambio(self, game):
+        # current_player's round is about to start, and they can call cambio (True) or not (False)
+        if game.cambio_player is not None:
+            raise ValueError("cambio has already been called")
+        return self.evaluate(game, None, [False, True])
+
+    def evaluate(self, game, drawn_card, candidates):
+        start = time.perf_counter()
+        deadline = time.time() + self.time_limit if self.time_limit is not None else None
+        seat = game.seat(game.current_player)
+        state = game.snapshot()
+        seeds = [self.rng.getrandbits(32) for _ in range(self.rollouts)]
+        batches = [seeds[i: i + self.batch_size] for i in range(0, len(seeds), self.batch_size)]
+        args = (state, seat, drawn_card, candidates)
+        if self.pool is None:
+            results = [play_rollouts(*args, batch, self.weights, deadline) for batch in batches]
+        else:
+            # batches still queued when the time is up come straight back without playing
+            futures = [self.pool.submit(play_rollouts, *args, batch, self.weights, deadline) for batch in batches]
+            results = [future.result() for future in futures]
+        if not any(result[1] for result in results):
+            # out of time before anything finished, one seed is better than no answer
+            results.append(play_rollouts(*args, seeds[:1], self.weights))
+
+        wins = [sum(result[0][i] for result in results) for i in range(len(candidates))]
+        played = sum(result[1] for result in results)
+        elapsed = time.perf_counter() - start
+        win_rates = [w / played for w in wins]
+        best = max(range(len(candidates)), key=lambda i: win_rates[i])
+        return {
+            'candidates': candidates,
+            'win_rates': win_rates,
+            'win_rate_intervals': [wilson_interval(w, played) for w in wins],
+            'best': candidates[best],
+            'rollouts': played,
+            'elapsed': elapsed,
+            'rollouts_per_sec': played * len(candidates) / elapsed,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,26 +1,374 @@
+import os
+import pickle
+import time
+from collections import Counter, deque
+from functools import partial
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from models import Game
+from models import Game, GameStats, MAX_ROUNDS
+from batch import BatchGame, NONE, REPLACE, SHOW_OPP, SHOW_OWN, SWAP, SHOW_AND_SWAP
+from progress import Progress
+from results import ACTIONS, ResultsWriter, concatenate_columns, count_rows, empty_columns
+from stats import RunningStats, Histogram, wilson_interval
 
-if __name__ == '__main__':
-    num_iterations = int(1e6)
+# number of games a BatchGame plays at once
+BATCH_SIZE = 4096
+
+# scores outside of this range still count towards the running stats, they just land in the
+# histograms' underflow/overflow
+SCORE_RANGE = (-2, 200)
 
-    player_one_wins = 0
-    player_two_wins = 0
-    player_one_scores = []
-    player_two_scores = []
-    num_rounds_list = []
-    for i in range(num_iterations):
-        game = Game()
-        if i % (num_iterations / 100) == 0:
-            print(f"{i / (num_iterations / 100)}%")
-        winner, player_one_hand, player_one_score, player_two_hand, player_two_score, num_rounds = game.start(random_state=i)
+
+class SimulationTotals:
+    # constant-memory summary of a range of seeds, see stats.py. merging chunks in any order
+    # gives exactly the same totals as one serial run
+    def __init__(self):
+        self.num_games = 0
+        self.player_one_wins = 0
+        self.player_two_wins = 0
+        self.player_one_scores = RunningStats()
+        self.player_two_scores = RunningStats()
+        self.num_rounds = RunningStats()
+        self.player_one_score_histogram = Histogram(*SCORE_RANGE)
+        self.player_two_score_histogram = Histogram(*SCORE_RANGE)
+        self.num_rounds_histogram = Histogram(0, MAX_ROUNDS + 1)
+        # GameStats of the games, only for instrumented runs
+        self.game_stats = None
+        # per-game columns (see results.py) of a chunk, only when they're being recorded.
+        # they're written out and dropped as the chunks come in, merge doesn't keep them
+        self.games = None
+
+    def add_game(self, winner, player_one_score, player_two_score, num_rounds):
+        self.num_games += 1
         if winner == 0:
-            player_one_wins += 1
+            self.player_one_wins += 1
         else:
-            player_two_wins += 1
-        player_one_scores.append(player_one_score)
-        player_two_scores.append(player_two_score)
-        num_rounds_list.append(num_rounds)
-    print(player_one_wins)
-    print(player_two_wins)
-    print(np.mean(num_rounds_list))
+            self.player_two_wins += 1
+        self.player_one_scores.add(player_one_score)
+        self.player_two_scores.add(player_two_score)
+        self.num_rounds.add(num_rounds)
+        self.player_one_score_histogram.add(player_one_score)
+        self.player_two_score_histogram.add(player_two_score)
+        self.num_rounds_histogram.add(num_rounds)
+
+    def add_games(self, winners, player_one_scores, player_two_scores, num_rounds):
+        # same as add_game for arrays of results
+        self.num_games += len(winners)
+        player_two_wins = int(np.count_nonzero(winners))
+        self.player_one_wins += len(winners) - player_two_wins
+        self.player_two_wins += player_two_wins
+        self.player_one_scores.add_array(player_one_scores)
+        self.player_two_scores.add_array(player_two_scores)
+        self.num_rounds.add_array(num_rounds)
+        self.player_one_score_histogram.add_array(player_one_scores)
+        self.player_two_score_histogram.add_array(player_two_scores)
+        self.num_rounds_histogram.add_array(num_rounds)
+
+    def merge(self, other):
+        self.num_games += other.num_games
+        self.player_one_wins += other.player_one_wins
+        self.player_two_wins += other.player_two_wins
+        self.player_one_scores.merge(other.player_one_scores)
+        self.player_two_scores.merge(other.player_two_scores)
+        self.num_rounds.merge(other.num_rounds)
+        self.player_one_score_histogram.merge(other.player_one_score_histogram)
+        self.player_two_score_histogram.merge(other.player_two_score_histogram)
+        self.num_rounds_histogram.merge(other.num_rounds_histogram)
+        if other.game_stats is not None:
+            if self.game_stats is None:
+                self.game_stats = GameStats()
+            self.game_stats.merge(other.game_stats)
+        return self
+
+    def mean_rounds(self):
+        return self.num_rounds.mean()
+
+    def win_rate(self):
+        # player one's
+        return self.player_one_wins / self.num_games if self.num_games else 0.0
+
+    def win_rate_interval(self, confidence=0.95):
+        return wilson_interval(self.player_one_wins, self.num_games, confidence)
+
+    def snapshot(self, confidence=0.95):
+        # plain summary of where the run is at, cheap enough to take after every chunk
+        low, high = self.win_rate_interval(confidence)
+        summary = {
+            'num_games': self.num_games,
+            'player_one_wins': self.player_one_wins,
+            'player_two_wins': self.player_two_wins,
+            'player_one_win_rate': self.win_rate(),
+            'player_one_win_rate_interval': (low, high),
+        }
+        for name, running in (('player_one_score', self.player_one_scores),
+                              ('player_two_score', self.player_two_scores),
+                              ('num_rounds', self.num_rounds)):
+            summary[name] = {
+                'mean': running.mean(),
+                'std': running.std(),
+                'min': running.min,
+                'max': running.max,
+            }
+        return summary
+
+    def __eq__(self, other):
+        # game_stats has timings in it, which are never going to match
+        ignored = ('game_stats', 'games')
+        return {key: value for key, value in vars(self).items() if key not in ignored} \
+            == {key: value for key, value in vars(other).items() if key not in ignored}
+
+
+def simulate_range(start, stop, instrument=False, record=False):
+    # plays the games for seeds [start, stop) on the current process. record=True keeps every
+    # game's results in totals.games
+    totals = SimulationTotals()
+    if instrument:
+        totals.game_stats = GameStats()
+    game = Game(stats=totals.game_stats)
+    if record:
+        game.action_counts = Counter()
+        columns = empty_columns(stop - start)
+        columns['seed'][:] = np.arange(start, stop)
+    for row, i in enumerate(range(start, stop)):
+        game.reset(seed=i)
+        result = game.start(capture_hands=False)
+        totals.add_game(result.winner, result.player_one_score, result.player_two_score, result.num_rounds)
+        if record:
+            columns['winner'][row] = result.winner
+            columns['player_one_score'][row] = result.player_one_score
+            columns['player_two_score'][row] = result.player_two_score
+            columns['num_rounds'][row] = result.num_rounds
+            columns['cambio_caller'][row] = -1 if game.cambio_player is None else game.seat(game.cambio_player)
+            columns['actions'][row] = [game.action_counts[action] for action in ACTIONS]
+    if record:
+        totals.games = columns
+    return totals
+
+
+def simulate_batch_range(start, stop, instrument=False, record=False):
+    # same as simulate_range but plays the games with the numpy engine. batch seeds are
+    # their own seed space, see batch.py
+    if instrument:
+        raise ValueError("the batch engine can't be instrumented, use engine='object'")
+    totals = SimulationTotals()
+    chunks = []
+    for batch_start in range(start, stop, BATCH_SIZE):
+        seeds = np.arange(batch_start, min(batch_start + BATCH_SIZE, stop))
+        game = BatchGame(seeds)
+        results = game.start()
+        totals.add_games(*results)
+        if record:
+            chunks.append(batch_columns(game, results))
+    if record:
+        totals.games = concatenate_columns(chunks) if chunks else empty_columns()
+    return totals
+
+
+def batch_columns(game, results):
+    # the per-game columns of a finished BatchGame
+    winners, player_one_scores, player_two_scores, num_rounds = results
+    counts = game.action_counts
+    return {
+        'seed': game.seeds,
+        'winner': winners,
+        'player_one_score': player_one_scores,
+        'player_two_score': player_two_scores,
+        'num_rounds': num_rounds,
+        'cambio_caller': game.cambio_callers(),
+        # the batch engine tells the two kinds of show apart, the object engine doesn't
+        'actions': np.stack([counts[:, NONE], counts[:, REPLACE], counts[:, SHOW_OPP] + counts[:, SHOW_OWN],
+                             counts[:, SWAP], counts[:, SHOW_AND_SWAP]], axis=1),
+    }
+
+
+ENGINES = {
+    'object': simulate_range,
+    'batch': simulate_batch_range,
+}
+
+
+def chunk_ranges(start, stop, chunk_size):
+    return [(i, min(i + chunk_size, stop)) for i in range(start, stop, chunk_size)]
+
+
+def timed_chunk(simulate, start, stop):
+    # simulate(start, stop), along with which process played it and how long it took
+    began = time.perf_counter()
+    totals = simulate(start, stop)
+    return os.getpid(), time.perf_counter() - began, totals
+
+
+def save_checkpoint(path, state):
+    # written to the side and swapped in, so getting killed mid-write can't lose the checkpoint
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def run_simulation(num_games, num_workers=None, chunk_size=None, start=0, engine='object', callback=None,
+                   instrument=False, output=None, checkpoint=None, checkpoint_interval=60, progress=None):
+    # splits the seed range into chunks and plays them on a process pool.
+    # num_workers=1 runs everything serially on this process. callback, if given, is called
+    # with the merged totals after every chunk so far, e.g. to print totals.snapshot().
+    # instrument=True collects GameStats for every game into totals.game_stats.
+    # output is a directory to write every game's results to, see results.py.
+    # checkpoint is a file to save the finished chunks and their totals to, at most every
+    # checkpoint_interval seconds and at the end. if it's already there the run picks up
+    # where it left off, and ends up with the same totals as if it had never stopped.
+    # progress is a progress.Progress to report games/s, ETA and per-worker speed to as the
+    # chunks come in, or True for one that prints to stderr
+    simulate = partial(timed_chunk, partial(ENGINES[engine], instrument=instrument, record=output is not None))
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    stop = start + num_games
+    if chunk_size is None:
+        # a few chunks per worker so a slow chunk doesn't leave the others idle
+        chunk_size = max(1, num_games // (num_workers * 8))
+        if engine == 'batch':
+            # the batch engine needs big chunks to get anywhere near its full speed
+            chunk_size = max(chunk_size, BATCH_SIZE)
+
+    totals = SimulationTotals()
+    completed = 0
+    # rows that were already in output before the run started, they're kept and added to
+    base_rows = count_rows(output) if output is not None else 0
+    job = {'num_games': num_games, 'start': start, 'engine': engine, 'instrument': instrument,
+           'output': output}
+    if checkpoint is not None and os.path.exists(checkpoint):
+        state = load_checkpoint(checkpoint)
+        if state['job'] != job:
+            raise ValueError(f"checkpoint {checkpoint} is for a different run: {state['job']}")
+        # the chunks have to line up with the finished ones, whatever num_workers is now
+        chunk_size = state['chunk_size']
+        completed = state['completed']
+        totals = state['totals']
+        base_rows = state.get('base_rows', 0)
+    all_ranges = chunk_ranges(start, stop, chunk_size)
+    ranges = all_ranges[completed:]
+    starts, stops = zip(*ranges) if ranges else ((), ())
+
+    # rows past the checkpoint were written after it was saved, they get played again. a cut off
+    # row from an earlier run goes as well, so every column starts the run on the same row
+    writer = ResultsWriter(output, num_rows=base_rows + totals.num_games) if output is not None else None
+    if progress is True:
+        progress = Progress(num_games)
+    if progress is not None:
+        progress.resume_from(totals.num_games)
+    last_save = time.monotonic()
+
+    def save():
+        if writer is not None:
+            writer.flush()
+        state = {'job': job, 'chunk_size': chunk_size, 'completed': completed, 'totals': totals,
+                 'base_rows': base_rows}
+        save_checkpoint(checkpoint, state)
+
+    def add(result):
+        nonlocal completed, last_save
+        worker, elapsed, chunk_totals = result
+        if progress is not None:
+            progress.update(chunk_totals.num_games, worker, elapsed)
+        if writer is not None:
+            # the chunks come back in seed order, so the rows do too. the pool carries on
+            # with the next chunks while this one is written
+            writer.add(chunk_totals.games)
+            chunk_totals.games = None
+        totals.merge(chunk_totals)
+        # chunks come back in order, so the finished ones are always the first `completed`
+        completed += 1
+        if checkpoint is not None and (time.monotonic() - last_save >= checkpoint_interval or completed == len(all_ranges)):
+            save()
+            last_save = time.monotonic()
+        if callback is not None:
+            callback(totals)
+
+    try:
+        if num_workers == 1:
+            for result in map(simulate, starts, stops):
+                add(result)
+            return totals
+
+        pool = ProcessPoolExecutor(max_workers=num_workers)
+        try:
+            for result in pool.map(simulate, starts, stops):
+                add(result)
+        finally:
+            # if the run is stopped, the chunks that haven't started yet are dropped instead
+            # of being waited for
+            pool.shutdown(cancel_futures=True)
+        return totals
+    finally:
+        if writer is not None:
+            writer.close()
+        if progress is not None:
+            progress.close()
+
+
+def run_until_settled(target_width, confidence=0.95, max_games=10 ** 7, num_workers=None, chunk_size=None, start=0,
+                      engine='object', callback=None, progress=None):
+    # like run_simulation, but instead of a fixed number of games it keeps playing chunks until
+    # player one's win rate interval is at most target_width wide (or max_games are played).
+    # chunks are checked in seed order, so it stops at the same chunk whatever num_workers is.
+    # totals.num_games is how many games it took. progress is as in run_simulation, with
+    # max_games as the total, so its ETA is for the longest the run can go on
+    simulate = partial(timed_chunk, ENGINES[engine])
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = BATCH_SIZE if engine == 'batch' else 1000
+    ranges = iter(chunk_ranges(start, start + max_games, chunk_size))
+
+    totals = SimulationTotals()
+    if progress is True:
+        progress = Progress(max_games)
+
+    def add(result):
+        # merges a chunk in, and returns whether that settled it
+        worker, elapsed, chunk_totals = result
+        if progress is not None:
+            progress.update(chunk_totals.num_games, worker, elapsed)
+        totals.merge(chunk_totals)
+        if callback is not None:
+            callback(totals)
+        low, high = totals.win_rate_interval(confidence)
+        return high - low <= target_width
+
+    try:
+        if num_workers == 1:
+            for chunk in ranges:
+                if add(simulate(*chunk)):
+                    break
+            return totals
+
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            # a couple of chunks per worker in flight, topped up one at a time as they're merged
+            pending = deque(pool.submit(simulate, *chunk) for chunk in islice(ranges, num_workers * 2))
+            while pending:
+                if add(pending.popleft().result()):
+                    for future in pending:
+                        future.cancel()
+                    break
+                for chunk in islice(ranges, 1):
+                    pending.append(pool.submit(simulate, *chunk))
+        return totals
+    finally:
+        if progress is not None:
+            progress.close()
+
+
+if __name__ == '__main__':
+    num_iterations = int(1e6)
+
+    totals = run_simulation(num_iterations, progress=True)
+    print(totals.player_one_wins)
+    print(totals.player_two_wins)
+    print(totals.mean_rounds())
+    low, high = totals.win_rate_interval()
+    print(f"player one wins {totals.win_rate():.4%} (95% CI {low:.4%} - {high:.4%})")
@@ -0,0 +1,143 @@
+import math
+from statistics import NormalDist
+import numpy as np
+
+# constant-memory summaries of simulation results. everything we summarise (scores, rounds)
+# is an int, so the accumulators are exact python ints: merging partial results in any order
+# gives exactly the same answer as one serial run
+
+
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_array(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += int(values.sum())
+        self.total_squares += int((values * values).sum())
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def variance(self):
+        # sample variance, worked out on the exact sums so there's no cancellation
+        if self.count < 2:
+            return 0.0
+        return (self.count * self.total_squares - self.total * self.total) / (self.count * (self.count - 1))
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+
+class Histogram:
+    # one bin per integer in [low, high), plus counts of everything below and above
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(high - low, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, value):
+        if value < self.low:
+            self.underflow += 1
+        elif value >= self.high:
+            self.overflow += 1
+        else:
+            self.counts[value - self.low] += 1
+
+    def add_array(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        below = values < self.low
+        above = values >= self.high
+        self.underflow += int(below.sum())
+        self.overflow += int(above.sum())
+        inside = values[~below & ~above] - self.low
+        self.counts += np.bincount(inside, minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def __getitem__(self, value):
+        return int(self.counts[value - self.low])
+
+    def __eq__(self, other):
+        return (self.low, self.high, self.underflow, self.overflow) == (other.low, other.high, other.underflow, other.overflow) \
+            and np.array_equal(self.counts, other.counts)
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+    # confidence interval for a win rate, behaves better than the normal one near 0 and 1
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (p + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return centre - half_width, centre + half_width
+
+
+class SPRT:
+    # wald's sequential probability ratio test on a win rate, p0 against p1. feed it results as
+    # they come in and stop as soon as decision() isn't None. alpha is the chance of picking p1
+    # when p0 is true, beta the other way round
+    def __init__(self, p0, p1, alpha=0.05, beta=0.05):
+        if not 0 < p0 < p1 < 1:
+            raise ValueError(f"need 0 < p0 < p1 < 1, got p0={p0} p1={p1}")
+        self.p0 = p0
+        self.p1 = p1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.win_weight = math.log(p1 / p0)
+        self.loss_weight = math.log((1 - p1) / (1 - p0))
+        self.wins = 0
+        self.trials = 0
+
+    def add(self, wins, trials):
+        self.wins += wins
+        self.trials += trials
+
+    def log_likelihood_ratio(self):
+        return self.wins * self.win_weight + (self.trials - self.wins) * self.loss_weight
+
+    def decision(self):
+        # p0 or p1 once one of them is accepted, None while it's still open
+        llr = self.log_likelihood_ratio()
+        if llr >= self.upper:
+            return self.p1
+        if llr <= self.lower:
+            return self.p0
+        return None
@@ -0,0 +1,185 @@
+import math
+import numpy as np
+from models import Game, Player, resolve_rng, CAMBIO_WEIGHT, DEFAULT_WEIGHTS, NUM_WEIGHTS, WEIGHT_INDEX
+from batch import BatchGame, split_rngs
+from stats import SPRT, RunningStats, wilson_interval
+
+# number of games a tournament hands to one BatchGame
+TOURNAMENT_BATCH_SIZE = 16384
+
+
+class WeightedPlayer(Player):
+    # the random Player, but the odds come from a weight vector (see models.NUM_WEIGHTS)
+    # instead of being hard-coded. DEFAULT_WEIGHTS plays exactly like Player
+    def __init__(self, weights=DEFAULT_WEIGHTS, rng=None):
+        super().__init__(rng)
+        self.weights = np.asarray(weights, dtype=float)
+        if self.weights.shape != (NUM_WEIGHTS,):
+            raise ValueError(f"expected {NUM_WEIGHTS} weights, got shape {self.weights.shape}")
+        # a decision is taken when the roll comes in over 1 - probability, the same way
+        # Player's 0.5 and 0.9 work
+        self.keep_thresholds = (1 - self.weights[:CAMBIO_WEIGHT]).tolist()
+        self.cambio_threshold = 1 - float(self.weights[CAMBIO_WEIGHT])
+
+    def handle_card(self, card, random_state=None):
+        decision = resolve_rng(self.rng, random_state).random()
+        if decision > self.keep_thresholds[WEIGHT_INDEX[card.id]]:
+            return self.replace_card(card)
+        else:
+            return self.play_card(card)
+
+    def decide_cambio(self, called_cambio, random_state=None):
+        if called_cambio:
+            return
+        if self.knowledge.own_hand.is_empty():
+            self.call_cambio()
+            return
+        decision = resolve_rng(self.rng, random_state).random()
+        if decision > self.cambio_threshold:
+            self.call_cambio()
+
+
+def tournament(weights, seeds, both_seats=True):
+    # plays every weight vector against every other one on the same seeds, with the batch
+    # engine. every pairing sees the same decks and the same random numbers (common random
+    # numbers), so the differences between them are down to the weights and not to luck.
+    # returns wins, where wins[i, j] is how many games i won against j, and the number of
+    # games each pair played
+    weights = np.asarray(weights, dtype=float)
+    seeds = np.asarray(seeds, dtype=np.int64)
+    k = len(weights)
+    firsts, seconds = np.nonzero(~np.eye(k, dtype=bool))
+    if not both_seats:
+        keep = firsts < seconds
+        firsts, seconds = firsts[keep], seconds[keep]
+
+    # every (pair, seed) is one game
+    pair_of_game = np.repeat(np.arange(len(firsts)), len(seeds))
+    seed_of_game = np.tile(seeds, len(firsts))
+    wins = np.zeros((k, k), dtype=np.int64)
+    for start in range(0, len(pair_of_game), TOURNAMENT_BATCH_SIZE):
+        pairs = pair_of_game[start: start + TOURNAMENT_BATCH_SIZE]
+        one, two = firsts[pairs], seconds[pairs]
+        game_weights = np.stack([weights[one], weights[two]], axis=1)
+        winners = BatchGame(seed_of_game[start: start + TOURNAMENT_BATCH_SIZE], weights=game_weights).start()[0]
+        np.add.at(wins, (np.where(winners == 0, one, two), np.where(winners == 0, two, one)), 1)
+    games_per_pair = len(seeds) * (2 if both_seats else 1)
+    return wins, games_per_pair
+
+
+def fitness(wins, games_per_pair):
+    # each weight vector's win rate against the whole field
+    k = len(wins)
+    return wins.sum(axis=1) / (games_per_pair * (k - 1))
+
+
+def compare_policies(weights_a, weights_b, margin=0.02, alpha=0.05, beta=0.05, batch_size=1000, max_games=10 ** 6,
+                     start=0):
+    # sequential test of whether a beats b: an SPRT of a's win rate at 0.5 - margin against
+    # 0.5 + margin, played batch_size seeds at a time (each seed in both seats) until it's settled
+    # or max_games are played. 'better'/'worse' means a's win rate is nearer 0.5 + margin or
+    # 0.5 - margin, None means it ran out of games first (with max_games=0 there's no win_rate)
+    sprt = SPRT(0.5 - margin, 0.5 + margin, alpha, beta)
+    weights = [weights_a, weights_b]
+    seed = start
+    while sprt.decision() is None and sprt.trials < max_games:
+        left = max_games - sprt.trials
+        # with an odd max_games the last seed is only played with a in the first seat, so it
+        # stops at max_games
+        num_seeds = min(batch_size, left // 2) or 1
+        wins, games_per_pair = tournament(weights, np.arange(seed, seed + num_seeds), both_seats=left > 1)
+        sprt.add(int(wins[0, 1]), games_per_pair)
+        seed += num_seeds
+
+    decision = sprt.decision()
+    return {
+        'decision': None if decision is None else ('better' if decision == sprt.p1 else 'worse'),
+        'num_games': sprt.trials,
+        'win_rate': sprt.wins / sprt.trials if sprt.trials else None,
+        'win_rate_interval': wilson_interval(sprt.wins, sprt.trials),
+        'log_likelihood_ratio': sprt.log_likelihood_ratio(),
+    }
+
+
+class PairedTotals:
+    # results of paired games, where every seed is played twice: a in the first seat, then b.
+    # both games deal the same deck and read the same random numbers, so most of the luck is
+    # the same on both sides and cancels out of the differences. per seed:
+    #   difference       a's wins minus b's wins over the pair, -1, 0 or 1
+    #   seat_difference  first seat's wins minus second seat's, -1, 0 or 1
+    # so difference.mean() is a's win rate minus b's, and seat_difference.mean() is the first
+    # player's win rate minus the second player's
+    def __init__(self):
+        self.num_seeds = 0
+        self.a_wins = 0
+        self.difference = RunningStats()
+        self.seat_difference = RunningStats()
+
+    def add_pairs(self, a_first_winners, b_first_winners):
+        # winners of the games with a in the first seat and with b in the first seat, as seats
+        a_first_winners = np.asarray(a_first_winners)
+        b_first_winners = np.asarray(b_first_winners)
+        a_won = (a_first_winners == 0).astype(np.int64) + (b_first_winners == 1)
+        first_won = (a_first_winners == 0).astype(np.int64) + (b_first_winners == 0)
+        self.num_seeds += len(a_won)
+        self.a_wins += int(a_won.sum())
+        self.difference.add_array(a_won - 1)
+        self.seat_difference.add_array(first_won - 1)
+
+    def merge(self, other):
+        self.num_seeds += other.num_seeds
+        self.a_wins += other.a_wins
+        self.difference.merge(other.difference)
+        self.seat_difference.merge(other.seat_difference)
+        return self
+
+    def win_rate(self):
+        # a's
+        return self.a_wins / (2 * self.num_seeds) if self.num_seeds else 0.0
+
+    def variance_reduction(self):
+        # how many times smaller the variance of a difference is than it would be if the two
+        # games of a pair were independent (2p(1-p) for a win rate of p)
+        p = self.win_rate()
+        variance = self.difference.variance()
+        return 2 * p * (1 - p) / variance if variance else math.inf
+
+    def snapshot(self):
+        summary = {'num_seeds': self.num_seeds, 'a_win_rate': self.win_rate(),
+                   'variance_reduction': self.variance_reduction()}
+        for name, running in (('difference', self.difference), ('seat_difference', self.seat_difference)):
+            summary[name] = {
+                'mean': running.mean(),
+                'variance': running.variance(),
+                'standard_error': math.sqrt(running.variance() / running.count) if running.count else 0.0,
+            }
+        return summary
+
+
+def paired_match(weights_a, weights_b, seeds, engine='batch'):
+    # plays every seed with a in the first seat and again with b in the first seat. the
+    # shuffles, the race dice and the players' decisions are on separate streams (see
+    # batch.split_rngs), so the two games keep the same decks and dice even once a and b
+    # start doing different things.
+    # engine='object' plays the exact same games one at a time through Game and WeightedPlayer
+    seeds = np.asarray(seeds, dtype=np.int64)
+    totals = PairedTotals()
+    if engine == 'object':
+        winners = [], []
+        for seed in seeds.tolist():
+            for seating, (first, second) in enumerate(((weights_a, weights_b), (weights_b, weights_a))):
+                game = Game(player_one=WeightedPlayer(first), player_two=WeightedPlayer(second), **split_rngs(seed))
+                winners[seating].append(game.start(capture_hands=False).winner)
+        totals.add_pairs(*winners)
+        return totals
+
+    pair_weights = np.array([[weights_a, weights_b], [weights_b, weights_a]], dtype=float)
+    step = TOURNAMENT_BATCH_SIZE // 2
+    for start in range(0, len(seeds), step):
+        chunk = seeds[start: start + step]
+        n = len(chunk)
+        # both seatings of a seed go in the same BatchGame
+        game_weights = np.repeat(pair_weights, n, axis=0)
+        winners = BatchGame(np.concatenate([chunk, chunk]), weights=game_weights, split_streams=True).start()[0]
+        totals.add_pairs(winners[:n], winners[n:])
+    return totals
@@ -1,6 +1,26 @@
+import os
+import pickle
+import random
+import io
+import statistics
+from collections import Counter
+import tempfile
 import unittest
-from models import Player, Card, Rank, Suit, Action, Hand
-from simulation import Game
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from models import DEFAULT_WEIGHTS, RANK_INDEX, CardCounter, KnownHand, GameStats, RaceOutcome, Player, Card, Rank, Suit, Action, Hand, Deck, CARDS, SCORE_TABLE, NUM_CARDS, card_id, encode_cards, decode_cards
+from utils import score_of_card
+from batch import BatchGame, TapeRandom, split_rngs
+from simulation import Game, SimulationTotals, run_simulation, run_until_settled, simulate_batch_range
+from bench import compare, draw_results
+from strategy import WeightedPlayer, PairedTotals, tournament, fitness, compare_policies, paired_match
+from optimizer import GeneticOptimizer
+from replay import ACTION, DECK, RESHUFFLE, START, SWAP, GameLog, Replayer, count_actions, load_log
+from progress import Progress
+from rollout import RolloutEvaluator, determinize, draw_candidates
+from ismcts import CAMBIO, CHANCE, DRAW, ISMCTSPlayer
+from results import ACTIONS, ResultsWriter, load_results, empty_columns
+from stats import SPRT, RunningStats, Histogram, wilson_interval
 
 class TestHand(unittest.TestCase):
     def setUp(self):
@@ -68,6 +88,73 @@ class TestHand(unittest.TestCase):
         self.assertEqual(self.hand.cards[4], nine)
 
 
+class TestDeck(unittest.TestCase):
+    def setUp(self):
+        self.deck = Deck(rng=random.Random(0))
+
+    def test_deal_from_front(self):
+        self.assertEqual(self.deck.deal(2), [CARDS[0], CARDS[1]])
+        self.assertEqual(self.deck.deal(1), [CARDS[2]])
+        self.assertEqual(self.deck.remaining(), 49)
+
+    def test_reshuffle_keeps_top_discard(self):
+        discard = Hand()
+        self.deck.deal(50)
+        discard.add_cards(CARDS[0:10])
+        discard_list = discard.cards
+        drawn = self.deck.deal(3, discard)
+        self.assertEqual(drawn[0:2], [CARDS[50], CARDS[51]])
+        # the top of the discard pile stays where it was
+        self.assertEqual(discard.cards, [CARDS[9]])
+        self.assertEqual(sorted(card.id for card in drawn[2:] + self.deck.cards[self.deck.top:]), list(range(9)))
+        self.assertEqual(self.deck.remaining(), 8)
+        # no list is shared between the two
+        self.assertIsNot(discard.cards, self.deck.cards)
+        self.assertIs(self.deck.cards, discard_list)
+
+    def test_deal_more_than_there_is(self):
+        discard = Hand()
+        discard.add_cards(CARDS[0:2])
+        self.deck.deal(52)
+        self.assertEqual(self.deck.deal(3, discard), [CARDS[0]])
+        self.assertTrue(self.deck.is_empty())
+        self.assertEqual(self.deck.deal(1), [])
+
+    def test_shuffle_only_undealt_cards(self):
+        self.deck.deal(40)
+        self.deck.shuffle(random_state=0)
+        self.assertEqual(sorted(card.id for card in self.deck.cards), list(range(40, 52)))
+
+
+class TestCard(unittest.TestCase):
+    def test_ids_follow_deck_order(self):
+        deck = Deck()
+        self.assertEqual([card.id for card in deck.cards], list(range(52)))
+        self.assertEqual(card_id(Rank.ACE, Suit.HEARTS), 0)
+        self.assertEqual(card_id(Rank.KING, Suit.SPADES), 51)
+
+    def test_cards_are_shared(self):
+        self.assertIs(Card(Rank.QUEEN, Suit.CLUBS), CARDS[card_id(Rank.QUEEN, Suit.CLUBS)])
+        self.assertIs(pickle.loads(pickle.dumps(Card(Rank.TWO, Suit.HEARTS))), Card(Rank.TWO, Suit.HEARTS))
+
+    def test_scores(self):
+        self.assertEqual(score_of_card(Card(Rank.ACE, Suit.SPADES)), 1)
+        self.assertEqual(score_of_card(Card(Rank.TEN, Suit.HEARTS)), 10)
+        self.assertEqual(score_of_card(Card(Rank.JACK, Suit.HEARTS)), 11)
+        self.assertEqual(score_of_card(Card(Rank.QUEEN, Suit.CLUBS)), 11)
+        self.assertEqual(score_of_card(Card(Rank.KING, Suit.HEARTS)), -1)
+        self.assertEqual(score_of_card(Card(Rank.KING, Suit.DIAMONDS)), -1)
+        self.assertEqual(score_of_card(Card(Rank.KING, Suit.CLUBS)), 30)
+        self.assertEqual(score_of_card(Card(Rank.KING, Suit.SPADES)), 30)
+        self.assertEqual(sum(SCORE_TABLE), 4 * (sum(range(1, 11)) + 22) + 58)
+
+    def test_encode_decode(self):
+        cards = [Card(Rank.ACE, Suit.HEARTS), Card(Rank.KING, Suit.SPADES)]
+        data = encode_cards(cards)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(decode_cards(data), cards)
+
+
 class TestPlayer(unittest.TestCase):
     def setUp(self):
         self.player = Player()
@@ -450,6 +537,1049 @@ class TestGame(unittest.TestCase):
         self.assertEqual(self.game.player_two.hand.cards[1], four)
         
 
+class TestGameRng(unittest.TestCase):
+    def play(self, seed):
+        winner, _, player_one_score, _, player_two_score, num_rounds = Game().start(seed=seed)
+        return winner, player_one_score, player_two_score, num_rounds
+
+    def test_same_seed_same_game(self):
+        self.assertEqual(self.play(7), self.play(7))
+
+    def test_random_state_is_seed(self):
+        results = Game().start(random_state=7)
+        self.assertEqual((results[0], results[2], results[4], results[5]), self.play(7))
+
+    def test_global_random_untouched(self):
+        random.seed(123)
+        expected = random.random()
+        random.seed(123)
+        self.play(7)
+        self.assertEqual(random.random(), expected)
+
+    def test_shared_rng(self):
+        rng = random.Random(7)
+        game = Game(rng=rng)
+        self.assertIs(game.deck.rng, rng)
+        self.assertIs(game.player_one.rng, rng)
+        self.assertIs(game.player_two.rng, rng)
+
+    def test_result_hands(self):
+        game = Game()
+        result = game.start(seed=7)
+        self.assertEqual(result.player_one_cards(), game.player_one.hand.cards)
+        self.assertEqual(result.player_two_cards(), game.player_two.hand.cards)
+        self.assertEqual(result.player_one_score, sum(card.score for card in result.player_one_cards()))
+
+    def test_summary_only(self):
+        result = Game().start(seed=7, capture_hands=False)
+        self.assertIsNone(result.player_one_hand)
+        self.assertIsNone(result.player_two_hand)
+        self.assertEqual((result.winner, result.player_one_score, result.player_two_score, result.num_rounds), self.play(7))
+
+    def test_reset_matches_fresh_game(self):
+        game = Game()
+        for seed in range(20):
+            game.reset(seed=seed)
+            result = game.start(capture_hands=False)
+            self.assertEqual((result.winner, result.player_one_score, result.player_two_score, result.num_rounds), self.play(seed))
+        game.reset()
+        self.assertEqual(len(game.deck.cards), 52)
+        self.assertTrue(game.discard.is_empty())
+        self.assertTrue(game.player_one.hand.is_empty())
+        self.assertTrue(game.player_two.knowledge.opp_hand.is_empty())
+        self.assertFalse(game.player_one.has_called_cambio)
+        self.assertIs(game.current_player, game.player_one)
+        self.assertEqual(game.num_rounds, 0)
+
+    def test_player_ids(self):
+        game = Game()
+        self.assertIsInstance(game.player_one.id, int)
+        self.assertNotEqual(game.player_one, game.player_two)
+
+    def test_concurrent_games(self):
+        seeds = list(range(50))
+        serial = [self.play(seed) for seed in seeds]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            threaded = list(pool.map(self.play, seeds))
+        self.assertEqual(serial, threaded)
+
+
+class TestBatchGame(unittest.TestCase):
+    def test_matches_object_engine(self):
+        seeds = random.Random(0).sample(range(10 ** 6), 300)
+        batch = BatchGame(seeds)
+        winners, player_one_scores, player_two_scores, num_rounds = batch.start()
+        for i, seed in enumerate(seeds):
+            winner, _, player_one_score, _, player_two_score, rounds = Game(rng=TapeRandom(seed)).start()
+            self.assertEqual(
+                (winner, player_one_score, player_two_score, rounds),
+                (winners[i], player_one_scores[i], player_two_scores[i], num_rounds[i]),
+                f"seed {seed}")
+
+    def test_split_streams_reused_game(self):
+        # one Game for every seed, reseeded by start like simulate_range does
+        seeds = list(range(100))
+        winners, player_one_scores, player_two_scores, num_rounds = BatchGame(seeds, split_streams=True).start()
+        game = Game(**split_rngs(12345))
+        for i, seed in enumerate(seeds):
+            game.reset()
+            winner, _, player_one_score, _, player_two_score, rounds = game.start(seed=seed)
+            self.assertEqual(
+                (winner, player_one_score, player_two_score, rounds),
+                (winners[i], player_one_scores[i], player_two_scores[i], num_rounds[i]),
+                f"seed {seed}")
+
+    def test_batch_size_does_not_matter(self):
+        seeds = list(range(100))
+        whole = BatchGame(seeds).start()
+        halves = [BatchGame(seeds[:37]).start(), BatchGame(seeds[37:]).start()]
+        for i in range(4):
+            self.assertEqual(list(whole[i]), list(halves[0][i]) + list(halves[1][i]))
+
+
+class TestRunningScores(unittest.TestCase):
+    def setUp(self):
+        self.game = Game(debug=True)
+        self.one = self.game.player_one
+        self.two = self.game.player_two
+
+    def test_add_delete_replace(self):
+        self.game.add_card(self.one, self.two, Card(Rank.KING, Suit.SPADES), known_card=True)
+        self.game.add_card(self.one, self.two, Card(Rank.FIVE, Suit.HEARTS))
+        self.assertEqual((self.one.score, self.one.knowledge.own_score), (35, 30))
+        self.game.replace_card(self.one, self.two, 0, Card(Rank.KING, Suit.HEARTS))
+        self.assertEqual((self.one.score, self.one.knowledge.own_score), (4, -1))
+        self.game.delete_card(self.one, self.two, 0)
+        self.assertEqual((self.one.score, self.one.knowledge.own_score), (-1, -1))
+
+    def test_show_and_swap(self):
+        self.game.add_card(self.one, self.two, Card(Rank.TWO, Suit.HEARTS), known_card=True)
+        self.game.add_card(self.two, self.one, Card(Rank.NINE, Suit.HEARTS))
+        self.game.show_card(self.one, self.two, 0)
+        self.game.show_card(self.one, self.two, 0)
+        self.assertEqual(self.one.knowledge.opp_score, 9)
+        self.game.swap_cards(self.one, self.two, 0, 0)
+        self.assertEqual((self.one.score, self.two.score), (9, 2))
+        self.assertEqual((self.one.knowledge.own_score, self.one.knowledge.opp_score), (9, 2))
+        self.assertEqual((self.two.knowledge.own_score, self.two.knowledge.opp_score), (0, 0))
+
+    def test_whole_games(self):
+        for seed in range(100):
+            self.game.reset(seed)
+            result = self.game.start()
+            self.assertEqual(result.player_one_score, sum(card.score for card in result.player_one_cards()))
+
+    def test_debug_catches_drift(self):
+        self.game.add_card(self.one, self.two, Card(Rank.TWO, Suit.HEARTS))
+        self.one.score += 1
+        with self.assertRaises(AssertionError):
+            self.game.add_card(self.one, self.two, Card(Rank.TWO, Suit.SPADES))
+
+
+class TestKnownHand(unittest.TestCase):
+    def setUp(self):
+        self.ace = Card(Rank.ACE, Suit.HEARTS)
+        self.king = Card(Rank.KING, Suit.SPADES)
+        self.hand = KnownHand()
+        self.hand.add_cards([None, self.ace, None, self.king])
+
+    def test_order(self):
+        self.assertEqual(len(self.hand), 4)
+        self.assertEqual(list(self.hand), [None, self.ace, None, self.king])
+        self.assertEqual(self.hand.known, 0b1010)
+        self.assertEqual(self.hand.pop(1), self.ace)
+        # the others keep their slots, only the bits go
+        self.assertEqual(self.hand.slots, [None, None, None, self.king])
+        self.assertEqual((self.hand.occupied, self.hand.known), (0b1101, 0b1000))
+        self.assertEqual(self.hand.slot(2), 3)
+        self.assertEqual(self.hand.index(3), 2)
+        self.hand.append(self.ace)
+        self.assertEqual(list(self.hand), [None, None, self.king, self.ace])
+        self.assertEqual(self.hand[-1], self.ace)
+        with self.assertRaises(IndexError):
+            self.hand.slot(4)
+        with self.assertRaises(IndexError):
+            self.hand.slot(-5)
+
+    def test_set_and_find(self):
+        self.assertEqual(self.hand.find_rank(RANK_INDEX[Rank.KING]), 3)
+        self.assertIsNone(self.hand.find_rank(RANK_INDEX[Rank.TWO]))
+        self.assertIsNone(self.hand.set(0, self.king))
+        self.assertEqual(self.hand.find_rank(RANK_INDEX[Rank.KING]), 0)
+        self.assertEqual(self.hand.set(0, None), self.king)
+        self.assertEqual(self.hand.known, 0b1010)
+
+    def test_exchange(self):
+        other = KnownHand()
+        other.add_cards([None, None])
+        self.assertEqual(self.hand.exchange(1, other, 0), (self.ace, None))
+        self.assertEqual(list(self.hand), [None, None, None, self.king])
+        self.assertEqual(list(other), [self.ace, None])
+        self.assertEqual(other.known, 0b1)
+
+    def test_empty_starts_again(self):
+        for _ in range(4):
+            self.hand.pop(0)
+        self.assertTrue(self.hand.is_empty())
+        self.assertEqual(self.hand.slots, [])
+        self.hand.append(None)
+        self.assertEqual(self.hand.slot(0), 0)
+
+    def test_cards_view(self):
+        cards = self.hand.cards
+        self.assertEqual(cards, [None, self.ace, None, self.king])
+        self.assertEqual(cards[1:3], [self.ace, None])
+        cards[0] = self.king
+        self.assertEqual(self.hand[0], self.king)
+        self.assertEqual(cards + [None], [self.king, self.ace, None, self.king, None])
+        self.hand.cards = [self.ace]
+        self.assertEqual((list(self.hand), self.hand.known), ([self.ace], 0b1))
+
+
+class TestSnapshot(unittest.TestCase):
+    def positions(self, seed):
+        # (game, the game's state with its rng, the game's result) after every round of a game
+        game = Game(rng=random.Random(seed), debug=True)
+        game.deal_hands()
+        states = [game.snapshot(rng=True)]
+        while game.num_rounds < 50 and not game.play_round():
+            states.append(game.snapshot(rng=True))
+        return game, states, game.finish()
+
+    def test_restore_plays_the_same(self):
+        spare = Game(debug=True)
+        for seed in range(20):
+            game, states, result = self.positions(seed)
+            self.assertEqual(result, Game(rng=random.Random(seed)).start())
+            for state in states:
+                spare.restore(state)
+                self.assertEqual(spare.play(), result)
+
+    def test_fork_does_not_leak(self):
+        for seed in range(20):
+            game = Game(rng=random.Random(seed), debug=True)
+            game.deal_hands()
+            over = any(game.play_round() for _ in range(seed % 7))
+            before = game.snapshot()
+            for fork_seed in range(5):
+                fork = game.fork(rng=random.Random(fork_seed))
+                self.assertEqual(fork.snapshot(), before)
+                fork.play()
+                self.assertEqual(game.snapshot(), before)
+            if not over:
+                self.assertEqual(game.play(), Game(rng=random.Random(seed)).start())
+
+    def test_state_is_immutable(self):
+        game, states, _ = self.positions(3)
+        state = states[len(states) // 2]
+        spare = Game(debug=True)
+        spare.restore(state)
+        self.assertIsNot(spare.deck.cards, game.deck.cards)
+        self.assertIsNot(spare.player_one.knowledge.own_hand.slots, state.player_one[3][0][0])
+        spare.play()
+        spare.restore(state)
+        self.assertEqual(spare.snapshot(), state._replace(rng=None))
+        pickle.loads(pickle.dumps(state))
+
+
+class TestRollout(unittest.TestCase):
+    def drawn(self, seed, rounds=4):
+        # a game where current_player has just drawn a card
+        game = Game(rng=random.Random(seed), debug=True)
+        game.deal_hands()
+        for _ in range(rounds):
+            game.play_round()
+        game.num_rounds += 1
+        return game, game.draw()
+
+    def test_determinize(self):
+        game, drawn_card = self.drawn(3)
+        state = game.snapshot()
+        seat = game.seat(game.current_player)
+        all_cards = list(state.player_one[0] + state.player_two[0] + state.deck + state.discard)
+        spare = Game(debug=True)
+        spare.restore(state)
+        opp_unseen = (spare.player_one, spare.player_two)[1 - seat].knowledge.counter.unseen
+        hands = set()
+        for seed in range(20):
+            determinize(spare, state, seat, random.Random(seed))
+            player = (spare.player_one, spare.player_two)[seat]
+            # the same cards, and what seat knows hasn't moved
+            cards = spare.player_one.hand.cards + spare.player_two.hand.cards + spare.deck.cards + spare.discard.cards
+            self.assertEqual(sorted(cards, key=hash), sorted(all_cards, key=hash))
+            self.assertEqual(player.knowledge.snapshot(), (state.player_one, state.player_two)[seat][3])
+            for known, card in zip(player.knowledge.own_hand, player.hand.cards):
+                self.assertTrue(known is None or known == card)
+            # the opp's counter has seen what they know now instead of what they knew, no more
+            opp = (spare.player_one, spare.player_two)[1 - seat]
+            counter = opp.knowledge.counter
+            known = [card for hand in (opp.knowledge.own_hand, opp.knowledge.opp_hand) for card in hand if card is not None]
+            self.assertTrue(all(counter.seen[card.id] for card in known))
+            self.assertEqual(counter.unseen, opp_unseen)
+            self.assertEqual(counter.unseen, NUM_CARDS - sum(counter.seen))
+            hands.add(encode_cards(spare.player_one.hand.cards + spare.player_two.hand.cards))
+        self.assertGreater(len(hands), 1)
+
+    def test_draw_candidates(self):
+        jack = Card(Rank.JACK, Suit.HEARTS)
+        self.assertEqual(len(draw_candidates(jack, 2, 3)), 1 + 2 + 6)
+        self.assertEqual(len(draw_candidates(jack, 2, 3, called_cambio=True)), 1 + 2)
+        self.assertEqual(draw_candidates(Card(Rank.SEVEN, Suit.HEARTS), 1, 1),
+                         [(Action.NONE, None, None), (Action.REPLACE, None, 0), (Action.SHOW, 0, None)])
+
+    def test_evaluate_draw(self):
+        game, drawn_card = self.drawn(3)
+        before = game.snapshot()
+        with RolloutEvaluator(rollouts=40, seed=1) as evaluator:
+            report = evaluator.evaluate_draw(game, drawn_card)
+        self.assertEqual(game.snapshot(), before)
+        self.assertEqual(report['rollouts'], 40)
+        self.assertEqual(len(report['win_rates']), len(report['candidates']))
+        self.assertTrue(all(0 <= p <= 1 for p in report['win_rates']))
+        self.assertIn(report['best'], report['candidates'])
+        with RolloutEvaluator(rollouts=40, seed=1, num_workers=2) as evaluator:
+            self.assertEqual(evaluator.evaluate_draw(game, drawn_card)['win_rates'], report['win_rates'])
+
+    def test_replacing_a_black_king_wins_more(self):
+        game = Game(rng=random.Random(0), debug=True)
+        game.deal_hands()
+        king, ace = Card(Rank.KING, Suit.SPADES), Card(Rank.ACE, Suit.HEARTS)
+        for card in (king, ace):
+            if card in game.deck.cards:
+                game.deck.cards.remove(card)
+            else:
+                self.skipTest("seed dealt the cards already")
+        game.add_discard(game.replace_card(game.player_one, game.player_two, 0, king))
+        game.num_rounds += 1
+        keep, replace = (Action.NONE, None, None), (Action.REPLACE, None, len(game.player_one.hand.cards) - 1)
+        with RolloutEvaluator(rollouts=200, seed=1) as evaluator:
+            report = evaluator.evaluate_draw(game, ace, [keep, replace])
+        self.assertEqual(report['best'], replace)
+        self.assertGreater(report['win_rates'][1], report['win_rates'][0] + 0.1)
+
+    def test_evaluate_cambio(self):
+        game = Game(rng=random.Random(5), debug=True)
+        game.deal_hands()
+        with RolloutEvaluator(rollouts=20, seed=1) as evaluator:
+            report = evaluator.evaluate_cambio(game)
+            self.assertEqual(report['candidates'], [False, True])
+            game.current_player.call_cambio()
+            game.cambio_player = game.current_player
+            with self.assertRaises(ValueError):
+                evaluator.evaluate_cambio(game)
+
+    def test_time_limit(self):
+        game, drawn_card = self.drawn(3)
+        with RolloutEvaluator(rollouts=10 ** 6, time_limit=0.05, seed=1) as evaluator:
+            report = evaluator.evaluate_draw(game, drawn_card)
+        self.assertLess(report['elapsed'], 1)
+        self.assertGreater(report['rollouts'], 0)
+        self.assertLess(report['rollouts'], 10 ** 6)
+
+
+class TestISMCTS(unittest.TestCase):
+    def bot_game(self, **kwargs):
+        bot = ISMCTSPlayer(seed=0, **kwargs)
+        game = Game(debug=True, player_one=bot)
+        bot.join(game)
+        return bot, game
+
+    def test_plays_whole_games(self):
+        bot, game = self.bot_game(time_limit=10, max_iterations=30)
+        reused = 0
+        for seed in range(5):
+            game.reset(seed)
+            game.start(capture_hands=False)
+            self.assertEqual(bot.last_search['iterations'], 30)
+            self.assertGreater(bot.last_search['iterations_per_sec'], 0)
+            reused = max(reused, bot.last_search['reused_visits'])
+        self.assertGreater(bot.iterations_per_sec(), 0)
+        # the tree from the last decision gets searched on from
+        self.assertGreater(reused, 0)
+
+    def test_tree_keys(self):
+        # every child is keyed by its kind of decision, so a cambio decision and a chance node
+        # under the same parent can't end up as one (False == 0 as a dict key)
+        bot, game = self.bot_game(time_limit=10, max_iterations=100)
+        roots = []
+        current_root = bot.current_root
+        bot.current_root = lambda: roots.append(current_root()) or roots[-1]
+        for seed in range(5):
+            game.reset(seed)
+            game.start(capture_hands=False)
+        stack = list(roots)
+        kinds = set()
+        while stack:
+            node = stack.pop()
+            for key, child in node.children.items():
+                self.assertIsInstance(key, tuple)
+                self.assertIn(key[0], (CAMBIO, CHANCE) + tuple(Action))
+                if key[0] == CAMBIO:
+                    self.assertIsInstance(key[1], bool)
+                kinds.add(key[0] if key[0] in (CAMBIO, CHANCE) else DRAW)
+                stack.append(child)
+        self.assertEqual(kinds, {CAMBIO, CHANCE, DRAW})
+
+    def test_time_limit(self):
+        bot, game = self.bot_game(time_limit=0.005)
+        game.reset(1)
+        game.start(capture_hands=False)
+        self.assertLess(bot.last_search['elapsed'], 0.1)
+        self.assertGreater(bot.last_search['iterations'], 0)
+
+    def test_beats_random_player(self):
+        bot, game = self.bot_game(time_limit=10, max_iterations=50)
+        game.debug = False
+        wins = 0
+        for seed in range(60):
+            game.reset(seed)
+            wins += game.start(capture_hands=False).winner == 0
+        self.assertGreater(wins / 60, 0.55)
+
+    def test_needs_a_game(self):
+        with self.assertRaises(RuntimeError):
+            ISMCTSPlayer().decide_cambio(False)
+
+    def test_swap_and_discard(self):
+        bot = ISMCTSPlayer()
+        black_king, red_king, ace = Card(Rank.KING, Suit.SPADES), Card(Rank.KING, Suit.HEARTS), Card(Rank.ACE, Suit.CLUBS)
+        bot.knowledge.own_hand.add_cards([ace, black_king])
+        bot.knowledge.opp_hand.add_cards([None, ace])
+        self.assertEqual(bot.play_card(Card(Rank.JACK, Suit.SPADES)), (Action.SWAP, 1, 1))
+        bot.knowledge.own_hand.cards = [red_king]
+        self.assertEqual(bot.try_discard(black_king), (Action.NONE, None, None))
+        bot.knowledge.opp_hand.cards = [None, black_king]
+        self.assertEqual(bot.try_discard(red_king), (Action.DISCARD, 1, None))
+
+
+class TestCardCounter(unittest.TestCase):
+    def test_see_and_forget(self):
+        counter = CardCounter()
+        self.assertEqual(counter.remaining(Rank.KING), 4)
+        self.assertAlmostEqual(counter.expected_score(), sum(SCORE_TABLE) / 52)
+        red_king = Card(Rank.KING, Suit.HEARTS)
+        counter.see(red_king)
+        counter.see(red_king)
+        self.assertEqual(counter.remaining(Rank.KING), 3)
+        self.assertEqual(counter.unseen, 51)
+        self.assertAlmostEqual(counter.expected_score(), (sum(SCORE_TABLE) + 1) / 51)
+        counter.forget(red_king)
+        self.assertEqual(counter.remaining(Rank.KING), 4)
+        self.assertEqual(counter.unseen_score, sum(SCORE_TABLE))
+
+    def test_game_updates(self):
+        game = Game()
+        ace = Card(Rank.ACE, Suit.HEARTS)
+        game.add_card(game.player_one, game.player_two, ace)
+        self.assertEqual(game.player_one.knowledge.counter.remaining(Rank.ACE), 4)
+        game.show_card(game.player_two, game.player_one, 0)
+        self.assertEqual(game.player_one.knowledge.counter.remaining(Rank.ACE), 4)
+        self.assertEqual(game.player_two.knowledge.counter.remaining(Rank.ACE), 3)
+        game.add_discard(Card(Rank.ACE, Suit.SPADES))
+        self.assertEqual(game.player_one.knowledge.counter.remaining(Rank.ACE), 3)
+        self.assertEqual(game.player_two.knowledge.counter.remaining(Rank.ACE), 2)
+
+    def test_whole_games(self):
+        game = Game()
+        for seed in range(300):
+            game.reset(seed)
+            game.start()
+            for player in (game.player_one, game.player_two):
+                counter = player.knowledge.counter
+                known = [card for card in player.knowledge.own_hand.cards + player.knowledge.opp_hand.cards if card is not None]
+                # everything known or face up has been seen, nothing left in the deck has
+                for card in known + game.discard.cards:
+                    self.assertTrue(counter.seen[card.id])
+                for card in game.deck.cards[game.deck.top:]:
+                    self.assertFalse(counter.seen[card.id])
+                self.assertEqual(counter.unseen, 52 - sum(counter.seen))
+                self.assertEqual(sum(counter.rank_counts), counter.unseen)
+
+
+class TestGameStats(unittest.TestCase):
+    def test_counts(self):
+        stats = GameStats()
+        game = Game(stats=stats)
+        results = []
+        for seed in range(50):
+            game.reset(seed)
+            results.append(game.start(capture_hands=False))
+        self.assertEqual(stats.games, 50)
+        self.assertEqual(stats.rounds, sum(result.num_rounds for result in results))
+        self.assertEqual(stats.races, sum(stats.race_outcomes.values()))
+        self.assertGreater(stats.actions[Action.REPLACE], 0)
+        self.assertLessEqual(stats.cambio_calls, 50)
+        self.assertGreater(stats.king_swaps, 0)
+        self.assertLessEqual(stats.king_swaps, stats.actions[Action.SHOW_AND_SWAP])
+        penalties = sum(stats.race_outcomes[outcome] for outcome in (RaceOutcome.OPP, RaceOutcome.DEFENSE_BROKEN, RaceOutcome.OPP_FLIP))
+        self.assertEqual(stats.penalties, penalties)
+        for phase in GameStats.PHASES:
+            self.assertGreater(stats.phase_times[phase], 0)
+
+    def test_same_games_with_stats(self):
+        for seed in range(20):
+            self.assertEqual(Game(stats=GameStats()).start(seed=seed), Game().start(seed=seed))
+
+    def test_race_outcome(self):
+        game = Game(stats=GameStats())
+        ace = Card(Rank.ACE, Suit.SPADES)
+        game.add_card(game.player_one, game.player_two, ace, known_card=True)
+        game.discard_race(Card(Rank.ACE, Suit.HEARTS))
+        self.assertEqual(game.stats.race_outcomes[RaceOutcome.OWN], 1)
+        self.assertEqual(game.stats.penalties, 0)
+
+    def test_king_swap(self):
+        game = Game(stats=GameStats())
+        game.reset(0)
+        game.deck.shuffle()
+        game.add_cards(game.player_one, game.player_two, game.deck.deal(4))
+        game.add_cards(game.player_two, game.player_one, game.deck.deal(4))
+        king = Card(Rank.KING, Suit.SPADES)
+        game.perform_action(Action.SHOW_AND_SWAP, 0, None, king, False)
+        self.assertEqual(game.stats.king_swaps, 1)
+        # no swapping after cambio, only the show
+        game.perform_action(Action.SHOW_AND_SWAP, 0, None, king, True)
+        self.assertEqual(game.stats.king_swaps, 1)
+        self.assertEqual(game.stats.summary()['king_swaps'], 1)
+
+    def test_simulation_stats(self):
+        totals = run_simulation(40, num_workers=2, chunk_size=10, instrument=True)
+        self.assertEqual(totals.game_stats.games, 40)
+        self.assertEqual(totals.game_stats.rounds, totals.num_rounds.total)
+
+
+class TestWeightedPlayer(unittest.TestCase):
+    def test_default_weights_play_like_player(self):
+        for seed in range(30):
+            game = Game(player_one=WeightedPlayer(), player_two=WeightedPlayer())
+            self.assertEqual(game.start(seed=seed), Game().start(seed=seed))
+
+    def test_weights(self):
+        player = WeightedPlayer([1.0] * 14 + [0.0], rng=random.Random(0))
+        player.knowledge.own_hand.cards = [None]
+        for card in CARDS:
+            self.assertEqual(player.handle_card(card)[0], Action.REPLACE)
+        for _ in range(100):
+            player.decide_cambio(False)
+        self.assertFalse(player.has_called_cambio)
+        with self.assertRaises(ValueError):
+            WeightedPlayer([0.5] * 3)
+
+    def test_matches_batch_engine(self):
+        rng = np.random.default_rng(0)
+        weights = rng.random((2, 15))
+        seeds = list(range(200))
+        winners, player_one_scores, player_two_scores, num_rounds = BatchGame(seeds, weights=weights).start()
+        for i, seed in enumerate(seeds):
+            game = Game(rng=TapeRandom(seed), player_one=WeightedPlayer(weights[0]), player_two=WeightedPlayer(weights[1]))
+            result = game.start()
+            self.assertEqual((result.winner, result.player_one_score, result.player_two_score, result.num_rounds),
+                             (winners[i], player_one_scores[i], player_two_scores[i], num_rounds[i]))
+
+    def test_tournament(self):
+        always_cambio = [0.5] * 14 + [1.0]
+        never_keep = [0.0] * 14 + [0.1]
+        weights = [list(DEFAULT_WEIGHTS), always_cambio, never_keep]
+        wins, games_per_pair = tournament(weights, range(300))
+        self.assertEqual(games_per_pair, 600)
+        for i in range(3):
+            self.assertEqual(wins[i, i], 0)
+            for j in range(3):
+                if i != j:
+                    self.assertEqual(wins[i, j] + wins[j, i], games_per_pair)
+        scores = fitness(wins, games_per_pair)
+        self.assertEqual(len(scores), 3)
+        self.assertAlmostEqual(scores.mean(), 0.5)
+
+    def test_compare_policies(self):
+        never_keep = [0.0] * 14 + [0.1]
+        result = compare_policies(DEFAULT_WEIGHTS, never_keep, batch_size=200)
+        self.assertEqual(result['decision'], 'better')
+        self.assertLess(result['num_games'], 10000)
+        self.assertEqual(compare_policies(never_keep, DEFAULT_WEIGHTS, batch_size=200)['decision'], 'worse')
+        # the same policy on both sides never settles, it just runs out of games
+        result = compare_policies(DEFAULT_WEIGHTS, DEFAULT_WEIGHTS, batch_size=200, max_games=2000)
+        self.assertIsNone(result['decision'])
+        self.assertEqual(result['num_games'], 2000)
+        result = compare_policies(DEFAULT_WEIGHTS, DEFAULT_WEIGHTS, batch_size=200, max_games=301)
+        self.assertEqual(result['num_games'], 301)
+        result = compare_policies(DEFAULT_WEIGHTS, never_keep, max_games=0)
+        self.assertEqual((result['decision'], result['num_games'], result['win_rate']), (None, 0, None))
+
+    def test_paired_match(self):
+        other = [0.5] * 14 + [0.2]
+        batch = paired_match(DEFAULT_WEIGHTS, other, range(300))
+        one_at_a_time = paired_match(DEFAULT_WEIGHTS, other, range(300), engine='object')
+        self.assertEqual((batch.num_seeds, batch.a_wins), (one_at_a_time.num_seeds, one_at_a_time.a_wins))
+        self.assertEqual(batch.difference, one_at_a_time.difference)
+        self.assertEqual(batch.seat_difference, one_at_a_time.seat_difference)
+        self.assertAlmostEqual(batch.difference.mean(), 2 * batch.win_rate() - 1)
+        # the common decks and dice take out a good part of the noise
+        self.assertGreater(batch.variance_reduction(), 1)
+
+    def test_paired_games_share_dice(self):
+        # one always keeps the card it draws and the other never does, and nobody calls cambio so
+        # the decks run out. the seatings play differently, but the k-th dice roll and the k-th
+        # shuffle still read the same numbers in both
+        always, never = [1.0] * 14 + [0.0], [0.0] * 14 + [0.0]
+        dice_checked = reshuffles_checked = 0
+        for seed in range(40):
+            rolls = []
+            for first, second in ((always, never), (never, always)):
+                rngs = split_rngs(seed)
+                dice, shuffles = [], []
+                rngs['rng'].random = lambda random=rngs['rng'].random: dice.append(random()) or dice[-1]
+                deck_rng = rngs['deck_rng']
+                deck_shuffle = deck_rng.shuffle
+                deck_rng.random = lambda random=deck_rng.random: shuffles[-1].append(random()) or shuffles[-1][-1]
+                deck_rng.shuffle = lambda x: shuffles.append([]) or deck_shuffle(x)
+                game = Game(player_one=WeightedPlayer(first), player_two=WeightedPlayer(second), **rngs)
+                game.start(capture_hands=False)
+                rolls.append((dice, shuffles))
+            (dice_a, shuffles_a), (dice_b, shuffles_b) = rolls
+            n = min(len(dice_a), len(dice_b))
+            self.assertEqual(dice_a[:n], dice_b[:n])
+            for a, b in zip(shuffles_a, shuffles_b):
+                n = min(len(a), len(b))
+                self.assertEqual(a[:n], b[:n])
+            dice_checked += min(len(dice_a), len(dice_b)) > 0
+            reshuffles_checked += min(len(shuffles_a), len(shuffles_b)) > 1
+        self.assertGreater(dice_checked, 0)
+        self.assertGreater(reshuffles_checked, 0)
+
+    def test_paired_match_same_policy(self):
+        # with the same policy in both seats the two games of a pair are the same game, so
+        # every pair is one win each
+        totals = paired_match(DEFAULT_WEIGHTS, DEFAULT_WEIGHTS, range(200))
+        self.assertEqual(totals.win_rate(), 0.5)
+        self.assertEqual(totals.difference.variance(), 0)
+        summary = totals.snapshot()
+        self.assertEqual(summary['difference']['standard_error'], 0)
+
+    def test_paired_totals(self):
+        totals = PairedTotals()
+        totals.add_pairs([0, 0, 1], [1, 0, 1])
+        self.assertEqual(totals.a_wins, 4)
+        self.assertEqual(totals.difference.total, 1)
+        self.assertEqual(totals.seat_difference.total, 0)
+        other = PairedTotals()
+        other.add_pairs([0], [0])
+        totals.merge(other)
+        self.assertEqual(totals.num_seeds, 4)
+        self.assertEqual(totals.seat_difference.total, 1)
+
+    def test_tournament_one_seat(self):
+        wins, games_per_pair = tournament([list(DEFAULT_WEIGHTS)] * 2, range(50), both_seats=False)
+        self.assertEqual(games_per_pair, 50)
+        self.assertEqual(wins.sum(), 50)
+
+
+class TestOptimizer(unittest.TestCase):
+    def optimizer(self, **kwargs):
+        return GeneticOptimizer(population_size=6, seeds_per_generation=30, elite=2, num_workers=1, **kwargs)
+
+    def test_step(self):
+        optimizer = self.optimizer()
+        report = optimizer.step()
+        self.assertEqual(optimizer.generation, 1)
+        self.assertEqual(report['games'], 7 * 6 * 30)
+        self.assertGreater(report['games_per_sec'], 0)
+        self.assertGreaterEqual(report['best_fitness'], report['mean_fitness'])
+        self.assertEqual(optimizer.population.shape, (6, 15))
+        self.assertTrue(((optimizer.population >= 0) & (optimizer.population <= 1)).all())
+        # the elite carries over unchanged
+        self.assertIn(report['best_weights'], optimizer.population.tolist())
+
+    def test_best_weights(self):
+        optimizer = self.optimizer()
+        optimizer.run(3)
+        best = optimizer.best_weights()
+        self.assertIn(best.tolist(), [report['best_weights'] for report in optimizer.history])
+        # picked by playing the generations' bests against each other, not by their best_fitness
+        for report in optimizer.history:
+            report['best_fitness'] = 1.0 if report['best_weights'] != best.tolist() else 0.0
+        self.assertTrue(np.array_equal(optimizer.best_weights(), best))
+
+    def test_generation_seeds_fixed(self):
+        optimizer = self.optimizer()
+        self.assertTrue(np.array_equal(optimizer.generation_seeds(3), optimizer.generation_seeds(3)))
+        self.assertFalse(np.array_equal(optimizer.generation_seeds(3), optimizer.generation_seeds(4)))
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            self.optimizer(checkpoint_path=path).run(2)
+            resumed = self.optimizer(checkpoint_path=path)
+            self.assertEqual(resumed.generation, 2)
+            resumed.run(3)
+            with self.assertRaises(ValueError):
+                self.optimizer(checkpoint_path=path, seed=1)
+            with self.assertRaises(ValueError):
+                GeneticOptimizer(population_size=8, seeds_per_generation=30, elite=2, num_workers=1,
+                                 checkpoint_path=path)
+            with self.assertRaises(ValueError):
+                self.optimizer(checkpoint_path=path, anchors=([0.5] * 14 + [0.2],))
+        uninterrupted = self.optimizer()
+        uninterrupted.run(3)
+        # everything but the timings is the same as a run that was never interrupted
+        for report, expected in zip(resumed.history, uninterrupted.history, strict=True):
+            self.assertEqual((report['best_fitness'], report['best_weights']),
+                             (expected['best_fitness'], expected['best_weights']))
+        self.assertTrue(np.array_equal(resumed.population, uninterrupted.population))
+
+    def test_parallel_matches_serial(self):
+        serial = self.optimizer()
+        parallel = GeneticOptimizer(population_size=6, seeds_per_generation=30, elite=2, num_workers=2)
+        self.assertTrue(np.array_equal(serial.evaluate(serial.population, 0),
+                                       parallel.evaluate(parallel.population, 0)))
+
+
+class TestReplay(unittest.TestCase):
+    def state(self, game):
+        # copies, the game reuses its lists for the next game
+        players = []
+        for player in (game.player_one, game.player_two):
+            knowledge = player.knowledge
+            players.append((list(player.hand.cards), list(knowledge.own_hand.cards), list(knowledge.opp_hand.cards),
+                            player.score, knowledge.own_score, knowledge.opp_score, bytes(knowledge.counter.seen),
+                            player.has_called_cambio))
+        return players, list(game.discard.cards), game.deck.cards[game.deck.top:], game.num_rounds
+
+    def test_replay_rebuilds_games(self):
+        log = GameLog()
+        game = Game(log=log)
+        states, results = [], []
+        reshuffled = False
+        for seed in range(300):
+            game.reset(seed)
+            results.append(game.start(capture_hands=False))
+            states.append(self.state(game))
+            reshuffled = reshuffled or game.deck.reshuffles > 0
+        self.assertTrue(reshuffled)
+
+        replayer = Replayer(log.events())
+        self.assertEqual(len(replayer), 300)
+        for i in range(300):
+            replayed = replayer.replay(i)
+            self.assertEqual(self.state(replayed), states[i])
+            self.assertEqual(replayed.decide_winner(False, capture_hands=False), results[i])
+        winners, num_rounds = replayer.results()
+        self.assertEqual(winners.tolist(), [result.winner for result in results])
+        self.assertEqual(num_rounds.tolist(), [result.num_rounds for result in results])
+
+    def test_replay_part_of_a_game(self):
+        log = GameLog()
+        game = Game(log=log)
+        game.start(seed=3)
+        replayer = Replayer(log.events())
+        self.assertEqual(replayer.replay(0, until=0).num_rounds, 0)
+        self.assertEqual(self.state(replayer.replay(0, until=len(replayer.game_events(0)))), self.state(game))
+        self.assertLess(replayer.replay(0, until=25).num_rounds, game.num_rounds)
+
+    def test_replay_until_a_king(self):
+        # stops right after a SHOW_AND_SWAP, before its race. the game keeps a copy of its state
+        # at the same point to compare with
+        test = self
+
+        class KingGame(Game):
+            def perform_action(self, action, opp_index, own_index, drawn_card, called_cambio):
+                self.king = action == Action.SHOW_AND_SWAP and not called_cambio
+                super().perform_action(action, opp_index, own_index, drawn_card, called_cambio)
+
+            def discard_race(self, top_card):
+                if self.king and self.after_king is None:
+                    self.after_king = test.state(self)
+                super().discard_race(top_card)
+
+        for seed in range(100):
+            log = GameLog()
+            game = KingGame(log=log)
+            game.king, game.after_king = False, None
+            game.start(seed=seed)
+            if game.after_king is not None:
+                break
+        self.assertIsNotNone(game.after_king)
+        # the events up to the first SWAP, which ends on its ACTION
+        kinds = [record[0] for record in log.events().tolist()
+                 if record[0] not in (START, DECK, RESHUFFLE)]
+        until = kinds.index(SWAP)
+        self.assertEqual(kinds[until - 1], ACTION)
+        replayer = Replayer(log.events())
+        self.assertEqual(self.state(replayer.replay(0, until=until)), game.after_king)
+
+    def test_log_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.log')
+            stats = GameStats()
+            with GameLog(path, buffer_size=64) as log:
+                game = Game(log=log, stats=stats)
+                for seed in range(50):
+                    game.reset(seed)
+                    game.start(capture_hands=False)
+                in_memory = log.events()
+            events = load_log(path)
+            self.assertEqual(events.tobytes(), in_memory.tobytes())
+            self.assertEqual(len(Replayer(events)), 50)
+            counts = count_actions(events)
+            self.assertEqual(counts, dict(stats.actions) | {action: 0 for action in Action if action not in stats.actions})
+            del events, in_memory
+
+
+class TestResults(unittest.TestCase):
+    def test_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            serial = run_simulation(300, num_workers=1, output=os.path.join(directory, 'serial'))
+            parallel = run_simulation(300, num_workers=2, chunk_size=40, output=os.path.join(directory, 'parallel'))
+            self.assertEqual(serial, parallel)
+            one = load_results(os.path.join(directory, 'serial'))
+            two = load_results(os.path.join(directory, 'parallel'))
+            for name in one:
+                self.assertTrue(np.array_equal(one[name], two[name]), name)
+            self.assertEqual(one['seed'].tolist(), list(range(300)))
+            self.assertEqual(int(one['winner'].sum()), serial.player_two_wins)
+            self.assertEqual(int(one['player_one_score'].sum()), serial.player_one_scores.total)
+            self.assertEqual(int(one['num_rounds'].sum()), serial.num_rounds.total)
+            # a drawn card every round, except for the round cambio got called in
+            self.assertEqual(one['actions'].sum(axis=1).tolist(),
+                             (one['num_rounds'] - (one['cambio_caller'] >= 0)).tolist())
+            del one, two
+
+    def test_runs_add_to_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            run_simulation(50, num_workers=1, output=directory)
+            run_simulation(50, num_workers=1, start=50, output=directory)
+            self.assertEqual(load_results(directory)['seed'].tolist(), list(range(100)))
+
+            # a resumed run keeps the rows from before it started too
+            checkpoint = os.path.join(directory, 'run.checkpoint')
+
+            def interrupt(totals):
+                if totals.num_games >= 20:
+                    raise KeyboardInterrupt()
+            with self.assertRaises(KeyboardInterrupt):
+                run_simulation(50, num_workers=1, chunk_size=10, start=100, output=directory, checkpoint=checkpoint,
+                               checkpoint_interval=0, callback=interrupt)
+            run_simulation(50, num_workers=1, start=100, output=directory, checkpoint=checkpoint)
+            self.assertEqual(load_results(directory)['seed'].tolist(), list(range(150)))
+
+    def test_batch_columns_match_object_engine(self):
+        columns = simulate_batch_range(0, 100, record=True).games
+        for seed in range(100):
+            game = Game(rng=TapeRandom(seed))
+            game.action_counts = Counter()
+            result = game.start(capture_hands=False)
+            self.assertEqual(columns['winner'][seed], result.winner)
+            self.assertEqual(columns['actions'][seed].tolist(), [game.action_counts[action] for action in ACTIONS])
+            caller = -1 if game.cambio_player is None else game.seat(game.cambio_player)
+            self.assertEqual(columns['cambio_caller'][seed], caller)
+
+    def test_writer_buffers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = ResultsWriter(directory, buffer_rows=10)
+            chunk = empty_columns(4)
+            chunk['seed'][:] = [1, 2, 3, 4]
+            writer.add(chunk)
+            self.assertEqual(len(load_results(directory)['seed']), 0)
+            writer.add(chunk)
+            writer.add(chunk)
+            self.assertEqual(len(load_results(directory)['seed']), 12)
+            writer.add(chunk)
+            writer.close()
+            columns = load_results(directory)
+            self.assertEqual(columns['seed'].tolist(), [1, 2, 3, 4] * 4)
+            self.assertEqual(columns['actions'].shape, (16, len(ACTIONS)))
+            del columns
+
+
+class TestProgress(unittest.TestCase):
+    def test_rate_limited(self):
+        now = [0.0]
+        out = io.StringIO()
+        progress = Progress(1000, interval=10, out=out, clock=lambda: now[0])
+        for worker in (1, 2, 1, 2):
+            now[0] += 2
+            progress.update(100, worker, 4.0)
+        # the first chunk is reported straight away, the rest wait for the interval
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
+        now[0] += 10
+        progress.update(100, 1, 4.0)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        progress.close()
+        progress.close()
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+        summary = progress.snapshot()
+        self.assertEqual(summary['games'], 500)
+        self.assertAlmostEqual(summary['games_per_sec'], 500 / 18)
+        self.assertAlmostEqual(summary['eta'], 500 / (500 / 18))
+        self.assertEqual(summary['worker_games_per_sec'], {1: 25.0, 2: 25.0})
+        self.assertIn('2 workers', out.getvalue().splitlines()[-1])
+
+    def test_simulation_progress(self):
+        out = io.StringIO()
+        progress = Progress(200, interval=0, out=out)
+        run_simulation(200, num_workers=2, chunk_size=50, progress=progress)
+        self.assertEqual(progress.games, 200)
+        self.assertEqual(sum(games for games, _ in progress.workers.values()), 200)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+        self.assertTrue(out.getvalue().startswith('50/200 games (25.0%)'))
+
+    def test_until_settled_progress(self):
+        out = io.StringIO()
+        progress = Progress(1000, interval=0, out=out)
+        totals = run_until_settled(0.001, num_workers=2, chunk_size=100, max_games=300, progress=progress)
+        self.assertEqual(progress.games, totals.num_games)
+        self.assertEqual(sum(games for games, _ in progress.workers.values()), 300)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+
+class TestSimulation(unittest.TestCase):
+    def test_parallel_matches_serial(self):
+        serial = run_simulation(200, num_workers=1)
+        parallel = run_simulation(200, num_workers=2, chunk_size=17)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(parallel.num_games, 200)
+        self.assertEqual(parallel.player_one_wins + parallel.player_two_wins, 200)
+
+    def test_batch_engine(self):
+        serial = run_simulation(300, num_workers=1, engine='batch')
+        parallel = run_simulation(300, num_workers=2, chunk_size=70, engine='batch')
+        self.assertEqual(serial, parallel)
+        self.assertEqual(serial.num_games, 300)
+
+    def test_merge(self):
+        one = SimulationTotals()
+        one.add_game(0, 10, 20, 5)
+        two = SimulationTotals()
+        two.add_game(1, 30, 4, 7)
+        one.merge(two)
+        self.assertEqual(one.num_games, 2)
+        self.assertEqual(one.player_one_wins, 1)
+        self.assertEqual(one.player_two_scores.total, 24)
+        self.assertEqual(one.num_rounds_histogram[7], 1)
+        self.assertEqual(one.mean_rounds(), 6)
+
+    def test_add_games_matches_add_game(self):
+        results = BatchGame(range(200)).start()
+        one = SimulationTotals()
+        one.add_games(*results)
+        two = SimulationTotals()
+        for winner, player_one_score, player_two_score, num_rounds in zip(*results):
+            two.add_game(int(winner), int(player_one_score), int(player_two_score), int(num_rounds))
+        self.assertEqual(one, two)
+
+    def test_snapshots(self):
+        snapshots = []
+        run_simulation(100, num_workers=1, chunk_size=25, callback=lambda totals: snapshots.append(totals.snapshot()))
+        self.assertEqual([snapshot['num_games'] for snapshot in snapshots], [25, 50, 75, 100])
+        low, high = snapshots[-1]['player_one_win_rate_interval']
+        self.assertLess(low, snapshots[-1]['player_one_win_rate'])
+        self.assertGreater(high, snapshots[-1]['player_one_win_rate'])
+
+    def test_run_until_settled(self):
+        totals = run_until_settled(0.1, num_workers=1, chunk_size=100)
+        low, high = totals.win_rate_interval()
+        self.assertLessEqual(high - low, 0.1)
+        # it stopped at the first chunk that was narrow enough
+        self.assertEqual(totals, run_simulation(totals.num_games, num_workers=1, chunk_size=100))
+        shorter = run_simulation(totals.num_games - 100, num_workers=1)
+        low, high = shorter.win_rate_interval()
+        self.assertGreater(high - low, 0.1)
+        self.assertEqual(run_until_settled(0.1, num_workers=2, chunk_size=100), totals)
+        self.assertEqual(run_until_settled(0.001, num_workers=1, chunk_size=100, max_games=250).num_games, 250)
+
+    def test_checkpoint_resume(self):
+        class Interrupted(Exception):
+            pass
+
+        def interrupt_after(num_games):
+            def callback(totals):
+                if totals.num_games >= num_games:
+                    raise Interrupted()
+            return callback
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'run.checkpoint')
+            output = os.path.join(directory, 'games')
+            uninterrupted = run_simulation(500, num_workers=1, chunk_size=50)
+            with self.assertRaises(Interrupted):
+                run_simulation(500, num_workers=1, chunk_size=50, output=output, checkpoint=checkpoint,
+                               checkpoint_interval=0, callback=interrupt_after(200))
+            # the second try is on a pool, with no chunk size, it carries on with the first one's
+            with self.assertRaises(Interrupted):
+                run_simulation(500, num_workers=2, output=output, checkpoint=checkpoint, checkpoint_interval=0,
+                               callback=interrupt_after(350))
+            seen = []
+            resumed = run_simulation(500, num_workers=1, output=output, checkpoint=checkpoint,
+                                     callback=lambda totals: seen.append(totals.num_games))
+            self.assertEqual(seen[0], 400)
+            self.assertEqual(resumed, uninterrupted)
+            self.assertEqual(load_results(output)['seed'].tolist(), list(range(500)))
+            # a finished run just gives its totals back
+            self.assertEqual(run_simulation(500, num_workers=1, output=output, checkpoint=checkpoint), uninterrupted)
+            with self.assertRaises(ValueError):
+                run_simulation(600, num_workers=1, checkpoint=checkpoint)
+
+
+class TestStats(unittest.TestCase):
+    def test_running_stats(self):
+        values = [3, -1, 30, 7, 7, 12]
+        running = RunningStats()
+        for value in values[:2]:
+            running.add(value)
+        rest = RunningStats()
+        rest.add_array(values[2:])
+        running.merge(rest)
+        self.assertEqual(running.count, 6)
+        self.assertAlmostEqual(running.mean(), statistics.mean(values))
+        self.assertAlmostEqual(running.variance(), statistics.variance(values))
+        self.assertEqual((running.min, running.max), (-1, 30))
+
+    def test_histogram(self):
+        histogram = Histogram(0, 5)
+        histogram.add_array([0, 1, 1, 4, 5, -1])
+        histogram.add(1)
+        self.assertEqual(histogram[1], 3)
+        self.assertEqual(histogram.underflow, 1)
+        self.assertEqual(histogram.overflow, 1)
+
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=4)
+        self.assertAlmostEqual(high, 0.5962, places=4)
+        low, high = wilson_interval(0, 10)
+        self.assertAlmostEqual(low, 0)
+
+    def test_sprt(self):
+        sprt = SPRT(0.45, 0.55)
+        sprt.add(52, 100)
+        self.assertIsNone(sprt.decision())
+        sprt.add(300, 500)
+        self.assertEqual(sprt.decision(), 0.55)
+        sprt = SPRT(0.45, 0.55)
+        sprt.add(200, 500)
+        self.assertEqual(sprt.decision(), 0.45)
+        with self.assertRaises(ValueError):
+            SPRT(0.55, 0.45)
+
+class TestBench(unittest.TestCase):
+    def test_compare(self):
+        baseline = {'results': {'deal': {'ops_per_sec': 100.0}, 'games': {'games_per_sec': 10.0, 'peak_memory_bytes': 1000}}}
+        results = {'results': {'deal': {'ops_per_sec': 95.0}, 'games': {'games_per_sec': 5.0, 'peak_memory_bytes': 2000}, 'new': {'ops_per_sec': 1.0}}}
+        rows = compare(results, baseline, tolerance=0.1)
+        self.assertEqual([(name, metric, regressed) for name, metric, _, _, regressed in rows], [
+            ('deal', 'ops_per_sec', False),
+            ('games', 'games_per_sec', True),
+            ('games', 'peak_memory_bytes', True),
+        ])
+
+    def test_draw_results(self):
+        results = draw_results(quick=True)
+        self.assertEqual(list(results), ['deck_draw_52', 'deck_draw_5200'])
+        for metrics in results.values():
+            self.assertEqual(list(metrics), ['draws_per_sec'])
+            self.assertGreater(metrics['draws_per_sec'], 0)
+
 if __name__ == '__main__':
     unittest.main()
 